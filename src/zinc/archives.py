@@ -1,6 +1,7 @@
 import os
 import tarfile
 import tempfile
+from contextlib import ExitStack
 
 import zinc.utils as utils
 import zinc.helpers as helpers
@@ -9,28 +10,80 @@ from zinc.models import ZincManifest
 from zinc.formats import Formats
 
 
-def build_archive_with_manifest(manifest: ZincManifest, src_dir, dst_path, flavor=None):
+def _open_tar(dst_path=None, dst_fileobj=None):
+    if dst_fileobj is not None:
+        # stream mode, the file object does not need to be seekable
+        return tarfile.open(fileobj=dst_fileobj, mode='w|')
+    return tarfile.open(dst_path, 'w')
 
-    files = manifest.get_all_files(flavor=flavor)
 
-    with tarfile.open(dst_path, 'w') as tar:
-        for f in files:
-            format, format_info = manifest.get_format_info_for_file(f)
-            assert format is not None
-            assert format_info is not None
-            sha = manifest.sha_for_file(f)
-            ext = helpers.file_extension_for_format(format)
+def _add_member(tars, manifest: ZincManifest, f, src_dir, gz_objects=None):
+    """Adds the file `f` of `manifest` to all `tars`. A GZ member is only
+    compressed once for all of them."""
 
-            path = os.path.join(src_dir, f)
-            arcname = helpers.append_file_extension(sha, ext)
+    format, format_info = manifest.get_format_info_for_file(f)
+    assert format is not None
+    assert format_info is not None
+    sha = manifest.sha_for_file(f)
+    ext = helpers.file_extension_for_format(format)
 
-            # TODO: write a test to ensure that file formats are written correctly
+    path = os.path.join(src_dir, f)
+    arcname = helpers.append_file_extension(sha, ext)
 
-            if format == Formats.RAW:
-                tar.add(path, arcname=arcname)
+    # TODO: write a test to ensure that file formats are written correctly
 
-            elif format == Formats.GZ:
-                gz_path = tempfile.mkstemp()[1]
-                utils.gzip_path(path, gz_path)
-                tar.add(gz_path, arcname=arcname)
-                os.remove(gz_path)
+    if format == Formats.RAW:
+        for tar in tars:
+            tar.add(path, arcname=arcname)
+
+    elif format == Formats.GZ:
+        if gz_objects is not None:
+            try:
+                gz_path = gz_objects.acquire(sha, path)
+                for tar in tars:
+                    tar.add(gz_path, arcname=arcname)
+            finally:
+                gz_objects.release(sha)
+        else:
+            with tempfile.NamedTemporaryFile() as gz_file:
+                utils.gzip_path(path, gz_file.name)
+                for tar in tars:
+                    tar.add(gz_file.name, arcname=arcname)
+
+
+def build_archive_with_manifest(manifest: ZincManifest, src_dir, dst_path=None, flavor=None,
+                                gz_objects=None, dst_fileobj=None):
+    """Builds the archive for `flavor` at `dst_path`, or streams it to the
+    writable file-like object `dst_fileobj`. RAW members are read from
+    `src_dir`. GZ members are compressed from `src_dir`. If `gz_objects` is
+    given, the compressed copies are obtained with `gz_objects.acquire(sha,
+    path)`, which returns their path, and handed back with
+    `gz_objects.release(sha)` once they were added."""
+
+    assert (dst_path is None) != (dst_fileobj is None)
+
+    with _open_tar(dst_path=dst_path, dst_fileobj=dst_fileobj) as tar:
+        for f in manifest.get_all_files(flavor=flavor):
+            _add_member([tar], manifest, f, src_dir, gz_objects=gz_objects)
+
+
+def build_archives_with_manifest(manifest: ZincManifest, src_dir, dst_fileobjs,
+                                 gz_objects=None):
+    """Streams the archives of several flavors to the writable file-like
+    objects in `dst_fileobjs`, a dict keyed by flavor, in a single pass over
+    the files. Each member is added to all archives which contain it at once,
+    so it is compressed only once. The archives are the same as the ones built
+    by `build_archive_with_manifest`, including `gz_objects` handling."""
+
+    flavors = list(dst_fileobjs.keys())
+    paths_by_flavor = dict((flavor, set(manifest.get_all_files(flavor=flavor)))
+                           for flavor in flavors)
+
+    with ExitStack() as stack:
+        tars = dict((flavor, stack.enter_context(_open_tar(dst_fileobj=dst_fileobjs[flavor])))
+                    for flavor in flavors)
+        # the files of a flavor are listed in the order of all files
+        for f in manifest.get_all_files():
+            member_tars = [tars[flavor] for flavor in flavors if f in paths_by_flavor[flavor]]
+            if len(member_tars) > 0:
+                _add_member(member_tars, manifest, f, src_dir, gz_objects=gz_objects)
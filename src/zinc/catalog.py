@@ -1,13 +1,20 @@
 import os
+import json
 import logging
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
 from urllib.parse import urlparse
 import tempfile
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 
-from zinc.models import ZincIndex, ZincManifest, ZincCatalogConfig, ZincFlavorSpec
+from zinc.models import ZincIndex, ZincManifest, ZincCatalogConfig, ZincFlavorSpec, INDEX_LAYOUT_SHARDED, diff_file_lists
 from zinc.defaults import defaults
 from zinc.formats import Formats
+from zinc.refs import ObjectRefs, OBJECT_REFS_FORMAT
 import zinc.helpers as helpers
 import zinc.utils as utils
 
@@ -49,9 +56,56 @@ class ZincCatalogPathHelper(object):
     def config_flavorspec_dir(self) -> str:
         return os.path.join(self.config_dir, "flavorspecs")
 
+    @property
+    def index_dir(self) -> str:
+        return "index"
+
+    @property
+    def journal_dir(self) -> str:
+        return "journal"
+
+    @property
+    def refs_dir(self) -> str:
+        return "refs"
+
+    @property
+    def gc_dir(self) -> str:
+        return "gc"
+
+    @property
+    def refs_shards_dir(self) -> str:
+        return os.path.join(self.refs_dir, "shards")
+
     def path_for_index(self) -> str:
         return defaults['catalog_index_name']
 
+    def path_for_index_root(self) -> str:
+        return os.path.join(self.index_dir, "root.json")
+
+    @property
+    def index_shards_dir(self) -> str:
+        return os.path.join(self.index_dir, "shards")
+
+    def path_for_index_shard(self, shard: str, digest: str) -> str:
+        # shards are named after their content, so a stored shard never
+        # changes and older roots can still be read
+        return os.path.join(self.index_shards_dir, "%s-%s.json" % (shard, digest))
+
+    def path_for_journal_head(self) -> str:
+        return os.path.join(self.journal_dir, "head.json")
+
+    def path_for_journal_record(self, seq: int) -> str:
+        return os.path.join(self.journal_dir, "%012d.json" % (seq))
+
+    def path_for_gc_state(self) -> str:
+        return os.path.join(self.gc_dir, "state.json")
+
+    def path_for_object_refs_info(self) -> str:
+        return os.path.join(self.refs_dir, "info.json")
+
+    def path_for_object_refs_shard(self, shard: str) -> str:
+        return os.path.join(self.refs_shards_dir, "%s.json" % (shard))
+
     def manifest_name(self, bundle_name: str, version: int) -> str:
         return "%s-%d.json" % (bundle_name, version)
 
@@ -169,6 +223,48 @@ class ZincAbstractCatalog(object):
 
         return self.get_manifest(bundle_name, resolved_version)
 
+    def get_manifests(self, bundle_versions: Iterable[Tuple[str, int]],
+                      jobs: Optional[int] = None) -> Iterator[Optional[ZincManifest]]:
+        """
+        Yields the manifests for `(bundle_name, version)` pairs, in the same
+        order, as returned by `get_manifest`. Up to `jobs` manifests are
+        fetched concurrently ahead of the one consumed, so only that many are
+        held at a time.
+        """
+        jobs = jobs or defaults['catalog_read_jobs']
+        if jobs == 1:
+            for bundle_name, version in bundle_versions:
+                yield self.get_manifest(bundle_name, version)
+            return
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = deque()
+            for bundle_name, version in bundle_versions:
+                pending.append(executor.submit(self.get_manifest, bundle_name, version))
+                if len(pending) >= jobs:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+
+    def diff_manifests(self, bundle_name: str, from_version: int, to_version: int,
+                       flavor: Optional[str] = None):
+        """
+        Yields a `ZincFileDiff` for every file that was added, removed or
+        modified between two versions of a bundle, see `diff_file_lists`.
+        Versions whose content digests in the index match are not loaded.
+        """
+        index = self.get_index()
+        from_digest = index.digest_for_bundle_version(bundle_name, from_version)
+        to_digest = index.digest_for_bundle_version(bundle_name, to_version)
+        if from_digest is not None and from_digest == to_digest:
+            return
+
+        from_manifest, to_manifest = self.get_manifests([(bundle_name, from_version),
+                                                         (bundle_name, to_version)])
+        if from_manifest is None or to_manifest is None:
+            raise ValueError("Manifest not found for %s" % (bundle_name))
+        for diff in diff_file_lists(from_manifest.files, to_manifest.files, flavor=flavor):
+            yield diff
+
     def manifest_for_bundle_descriptor(self, bundle_descriptor: str) -> Optional[ZincManifest]:
         """
         Convenience method to get a manifest by bundle_descriptor.
@@ -180,15 +276,17 @@ class ZincAbstractCatalog(object):
     def bundle_descriptors(self) -> List[str]:
         bundle_descriptors = []
         index = self.get_index()
-        for bundle_name in index.bundle_names():
-            for version in index.versions_for_bundle(bundle_name):
-                bundle_descriptors.append("%s-%d" % (bundle_name, version))
-                manifest = self.manifest_for_bundle(bundle_name, version)
-                if manifest is None:
-                    log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
-                    continue
-                for flavor in manifest.flavors:
-                    bundle_descriptors.append("%s-%d~%s" % (bundle_name, version, flavor))
+        bundle_versions = [(bundle_name, version)
+                           for bundle_name in index.bundle_names()
+                           for version in index.versions_for_bundle(bundle_name)]
+        manifests = self.get_manifests(bundle_versions)
+        for (bundle_name, version), manifest in zip(bundle_versions, manifests):
+            bundle_descriptors.append("%s-%d" % (bundle_name, version))
+            if manifest is None:
+                log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
+                continue
+            for flavor in manifest.flavors:
+                bundle_descriptors.append("%s-%d~%s" % (bundle_name, version, flavor))
         return bundle_descriptors
 
 
@@ -206,8 +304,16 @@ class ZincCatalogLock(object):
         self._catalog._reload()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self._catalog.save()
-        self._lock.release()
+        try:
+            if exc_type is not None and self._catalog._in_transaction:
+                # a failed transaction leaves the index unchanged
+                self._catalog._discard_index_changes()
+            else:
+                self._catalog.save()
+                # nobody else can have written the index while the lock was held
+                self._catalog._update_index_version_token()
+        finally:
+            self._lock.release()
 
     def is_locked(self):
         return self._lock.is_locked()
@@ -216,7 +322,7 @@ class ZincCatalogLock(object):
 class ZincCatalog(ZincAbstractCatalog):
 
     def __init__(self, storage=None, coordinator=None, path_helper=None,
-                 lock_timeout=None, **kwargs):
+                 lock_timeout=None, sharded_index=None, journal=None, **kwargs):
         assert storage
 
         super(ZincCatalog, self).__init__(**kwargs)
@@ -224,10 +330,50 @@ class ZincCatalog(ZincAbstractCatalog):
         self._coordinator = coordinator
         self._storage = storage
 
+        # Catalogs whose index was written sharded are always read and written
+        # sharded, see `_read_index`.
+        if sharded_index is None:
+            sharded_index = defaults['catalog_index_sharded']
+        self._sharded_index = sharded_index
+
+        # Likewise for the journal, see `_read_index`.
+        if journal is None:
+            journal = defaults['catalog_index_journal']
+        self._journal = journal
+        # journal sequence number of the last written index snapshot
+        self._journal_snapshot_seq = None
+
         self._ph = path_helper or ZincCatalogPathHelper()
-        self._manifests = {}
+        # Manifests are immutable once written, so they can be shared freely.
+        self._manifests = utils.LRUCache(defaults['catalog_manifest_cache_size'],
+                                         max_size=defaults['catalog_manifest_cache_max_bytes'])
         self.lock_timeout = lock_timeout or defaults['catalog_lock_timeout']
 
+        # Indexes and manifests in the catalog are only written by zinc, so
+        # validating them on every read can be disabled.
+        self._trusted_reads = not defaults['catalog_validate_reads']
+
+        self.index = None
+        self._in_transaction = False
+
+        # The object reference index is only maintained if the catalog has
+        # one, see `rebuild_object_refs`. It is read again after the index
+        # changed, since both are written together. Rebuilding it changes the
+        # index too, see `ZincIndex.object_refs_generation`.
+        self._has_object_refs = None
+        self._object_refs = None
+
+        # version token of the index as of the last read or write
+        self._index_version_token = None
+        # version tokens returned by the puts of the last save
+        self._saved_version_tokens = dict()
+
+        # immutable snapshot handed out by `get_index`, and the index and
+        # generation it was taken from
+        self._index_snapshot = None
+        self._index_snapshot_source = None
+        self._index_snapshot_generation = None
+
         self._reload()
 
         if self._coordinator is not None:
@@ -239,6 +385,18 @@ class ZincCatalog(ZincAbstractCatalog):
         assert self._lock
         return self._lock
 
+    @contextmanager
+    def _read_lock(self):
+        """Holds the catalog lock while the index is only read, so unlike
+        `lock` the index is not written again on release."""
+        assert self._lock
+        self._lock._lock.acquire()
+        try:
+            self._reload()
+            yield self
+        finally:
+            self._lock._lock.release()
+
     # Properties
 
     @property
@@ -262,14 +420,63 @@ class ZincCatalog(ZincAbstractCatalog):
 
     # General Internal Methods
 
+    def _path_for_index_version_token(self):
+        # the journal head and the root of a sharded index are rewritten
+        # whenever the index changes
+        if self._journal:
+            return self._ph.path_for_journal_head()
+        if self._sharded_index:
+            return self._ph.path_for_index_root()
+        return self._ph.path_for_index()
+
+    def _get_index_version_token(self):
+        meta = self._storage.get_meta(self._path_for_index_version_token())
+        return meta.get('version_token') if meta is not None else None
+
+    def _update_index_version_token(self):
+        """Updates the token after a save under the lock, from the puts of
+        the save if possible."""
+        subpath = self._path_for_index_version_token()
+        if subpath in self._saved_version_tokens:
+            token = self._saved_version_tokens[subpath]
+        elif self._index_version_token is not None:
+            return  # not rewritten by the save
+        else:
+            token = None
+        if token is None:
+            token = self._get_index_version_token()
+        self._index_version_token = token
+
     def _reload(self):
 
-        self.index = self._read_index()
-        if self.index.format != defaults['zinc_format']:
-            raise Exception("Incompatible format %s" % (self.index.format))
+        # Only read the index if it changed since it was last read or written.
+        # The token is fetched *before* the index is read, so a concurrent
+        # write results in an extra reload rather than a missed one.
+        token = self._get_index_version_token()
+        if token is None or token != self._index_version_token:
+            refs_generation = self.index.object_refs_generation if self.index is not None else None
+            # In journal mode, catch up by replaying new records if possible.
+            if not (self._journal and self._replay_new_journal_records()):
+                index = self._read_index()
+                if index.format != defaults['zinc_format']:
+                    raise Exception("Incompatible format %s" % (index.format))
+                self.index = index
+            self._index_version_token = token
+            self._object_refs = None
+            if self.index.object_refs_generation != refs_generation:
+                # rebuilt by another writer
+                self._has_object_refs = None
+        else:
+            log.debug("Index unchanged, skipping reload.")
 
         self._read_config_file()
 
+    def _discard_index_changes(self):
+        self.index.pop_journal_ops()
+        self.index = None
+        self._index_version_token = None
+        self._reload()
+
     def _read_config_file(self):
         # log.warn('reimplement config loading')
         self.config = ZincCatalogConfig()
@@ -283,33 +490,209 @@ class ZincCatalog(ZincAbstractCatalog):
             return f.read()
         return None
 
-    def _write(self, subpath: str, bytes: bytes, raw: bool = True, gzip: bool = True, max_age: Optional[int] = None):
+    def _puts_for_write(self, subpaths: List[str], bytes: bytes, raw: bool = True, gzip: bool = True):
+        """Returns `(subpath, bytes)` pairs for writing `bytes` to all
+        `subpaths`, raw and/or gzipped. The bytes are only gzipped once."""
+        puts = list()
         if raw:
-            self._storage.puts(subpath, bytes, max_age=max_age)
+            puts.extend((subpath, bytes) for subpath in subpaths)
         if gzip:
-            self._storage.puts(subpath + '.gz', utils.gzip_bytes(bytes), max_age=max_age)
+            gz_bytes = utils.gzip_bytes(bytes)
+            puts.extend((subpath + '.gz', gz_bytes) for subpath in subpaths)
+        return puts
+
+    def _put_many(self, puts, max_age: Optional[int] = None):
+        """Issues the `(subpath, bytes)` pairs in `puts` concurrently."""
+        if len(puts) == 1:
+            subpath, bytes = puts[0]
+            self._saved_version_tokens[subpath] = self._storage.puts(subpath, bytes, max_age=max_age)
+            return
+        jobs = min(len(puts), defaults['catalog_write_jobs'])
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            futures = [(subpath, executor.submit(self._storage.puts, subpath, bytes, max_age=max_age))
+                       for subpath, bytes in puts]
+            for subpath, future in futures:
+                self._saved_version_tokens[subpath] = future.result()
+
+    def _write(self, subpath: str, bytes: bytes, raw: bool = True, gzip: bool = True, max_age: Optional[int] = None):
+        self._put_many(self._puts_for_write([subpath], bytes, raw=raw, gzip=gzip),
+                       max_age=max_age)
 
     def _read_index(self):
+        root_path = self._ph.path_for_index_root()
+        if self._sharded_index and self._storage.get_meta(root_path) is not None:
+            return self._read_sharded_index()
+
         subpath = self._ph.path_for_index()
         bytes = self._read(subpath).decode('utf-8')
-        return ZincIndex.from_bytes(bytes)
+        index = ZincIndex.from_bytes(bytes, trusted=self._trusted_reads)
+        if index.layout == INDEX_LAYOUT_SHARDED:
+            # the catalog was sharded by another writer
+            self._sharded_index = True
+            return self._read_sharded_index()
+        return self._index_from_snapshot(index)
+
+    def _read_sharded_index(self):
+        root = json.loads(self._read(self._ph.path_for_index_root()).decode('utf-8'))
+        index = ZincIndex.from_shard_root(root, self._read_index_shard)
+        return self._index_from_snapshot(index)
+
+    def _read_index_shard(self, shard, digest):
+        subpath = self._ph.path_for_index_shard(shard, digest)
+        d = json.loads(self._read(subpath).decode('utf-8'))
+        return d['bundles']
+
+    def _write_index_shards(self, index, raw=True, gzip=True, max_age=None):
+        index.shard(defaults['catalog_index_shard_prefix_length'],
+                    load_shard=self._read_index_shard)
+        root = index.to_shard_root_dict()
+        puts = list()
+        for shard, bytes in sorted(index.changed_shards().items()):
+            subpath = self._ph.path_for_index_shard(shard, root['shards'][shard])
+            puts.extend(self._puts_for_write([subpath], bytes, raw=raw, gzip=gzip))
+        if len(puts) > 0:
+            self._put_many(puts, max_age=max_age)
+        # The root is written last, so readers never see a root referencing
+        # shards that were not written yet.
+        self._write(self._ph.path_for_index_root(), json.dumps(root).encode('utf8'),
+                    raw=raw, gzip=gzip, max_age=max_age)
+        index.mark_shards_saved(root)
 
     def _write_index(self, index, raw=True, gzip=True):
         subpath = self._ph.path_for_index()
-        bytes = index.to_bytes()
         max_age = defaults['catalog_index_max_age_seconds']
-        self._write(subpath, bytes, raw=raw, gzip=gzip, max_age=max_age)
+        if self._sharded_index:
+            self._write_index_shards(index, raw=raw, gzip=gzip, max_age=max_age)
+            if defaults['catalog_write_single_file_index']:
+                bytes = index.to_bytes()
+            else:
+                # only tells readers to use the shards
+                bytes = ZincIndex(id=index.id, layout=index.layout).to_bytes()
+        else:
+            bytes = index.to_bytes()
+        subpaths = [subpath]
         if defaults['catalog_write_legacy_index']:
-            self._write('index.json', bytes, raw=raw, gzip=gzip, max_age=max_age)
+            subpaths.append('index.json')
+        self._put_many(self._puts_for_write(subpaths, bytes, raw=raw, gzip=gzip),
+                       max_age=max_age)
+
+    def _read_journal_head_seq(self):
+        subpath = self._ph.path_for_journal_head()
+        if self._storage.get_meta(subpath) is None:
+            return None
+        return json.loads(self._read(subpath).decode('utf-8'))['seq']
+
+    def _index_from_snapshot(self, index):
+        """Completes an index read from storage by replaying the journal."""
+        if index.journal_seq is not None:
+            # the snapshot was written by a catalog in journal mode
+            self._journal = True
+            self._journal_snapshot_seq = index.journal_seq
+            self._replay_journal(index)
+        return index
+
+    def _replay_journal(self, index, head_seq=None):
+        """Applies the journal records newer than `index` to `index`."""
+        if head_seq is None:
+            head_seq = self._read_journal_head_seq() or 0
+        for seq in range(index.journal_seq + 1, head_seq + 1):
+            record = json.loads(self._read(self._ph.path_for_journal_record(seq)).decode('utf-8'))
+            index.apply_journal_ops(record['ops'])
+            index.journal_seq = seq
+
+    def _replay_new_journal_records(self):
+        """Brings the in-memory index up to date by replaying the journal
+        records written since it was read. Returns `False` if the records are
+        not available anymore, in which case the index must be read again."""
+        index = self.index
+        if index is None or index.journal_seq is None:
+            return False
+        head_seq = self._read_journal_head_seq()
+        if head_seq is None:
+            return False
+        if head_seq > index.journal_seq:
+            subpath = self._ph.path_for_journal_record(index.journal_seq + 1)
+            if self._storage.get_meta(subpath) is None:
+                return False  # compacted
+        self._replay_journal(index, head_seq=head_seq)
+        return True
+
+    def _append_journal(self, index):
+        """Writes the operations recorded by `index` since the last save as a
+        new journal record, compacting the journal when it gets too long."""
+        if index.journal_seq is None:
+            # the first snapshot marks the catalog as journaled
+            index.pop_journal_ops()
+            index.journal_seq = 0
+            self._compact_journal(index)
+            return
+
+        ops = index.pop_journal_ops()
+        if len(ops) == 0:
+            return
+        seq = index.journal_seq + 1
+        record = {'seq': seq, 'ops': ops}
+        self._write(self._ph.path_for_journal_record(seq),
+                    json.dumps(record).encode('utf8'), gzip=False)
+        # the record only becomes visible to readers once the head is written
+        self._write(self._ph.path_for_journal_head(),
+                    json.dumps({'seq': seq}).encode('utf8'), gzip=False)
+        index.journal_seq = seq
+
+        threshold = defaults['catalog_index_journal_compaction_threshold']
+        if seq - (self._journal_snapshot_seq or 0) >= threshold:
+            self._compact_journal(index)
+
+    def _compact_journal(self, index):
+        """Writes a full snapshot of `index`, which includes all journal
+        records up to its `journal_seq`."""
+        previous_snapshot_seq = self._journal_snapshot_seq or 0
+        self._write_index(index)
+        self._write(self._ph.path_for_journal_head(),
+                    json.dumps({'seq': index.journal_seq}).encode('utf8'), gzip=False)
+        self._journal_snapshot_seq = index.journal_seq
+
+        # Records folded into the *previous* snapshot are not needed anymore.
+        # Newer ones are kept for readers which still read that snapshot.
+        for f in self._storage.list(self._ph.journal_dir):
+            name = os.path.splitext(f)[0]
+            if name.isdigit() and int(name) <= previous_snapshot_seq:
+                self._storage.delete(os.path.join(self._ph.journal_dir, f))
+
+    @property
+    def has_object_refs(self) -> bool:
+        if self._has_object_refs is None:
+            meta = self._storage.get_meta(self._ph.path_for_object_refs_info())
+            self._has_object_refs = meta is not None
+        return self._has_object_refs
+
+    def _get_object_refs(self) -> Optional[ObjectRefs]:
+        if self._object_refs is None and self.has_object_refs:
+            self._object_refs = ObjectRefs(load_shard=self._read_object_refs_shard)
+        return self._object_refs
+
+    def _read_object_refs_shard(self, shard):
+        subpath = self._ph.path_for_object_refs_shard(shard)
+        if self._storage.get_meta(subpath) is None:
+            return None
+        return ObjectRefs.shard_from_bytes(self._read(subpath))
+
+    def _object_refs_shard_names(self):
+        return [os.path.splitext(f)[0] for f in self._storage.list(self._ph.refs_shards_dir)
+                if f.endswith('.json')]
+
+    def _write_object_refs(self):
+        if self._object_refs is None:
+            return
+        puts = [(self._ph.path_for_object_refs_shard(shard), bytes)
+                for shard, bytes in self._object_refs.pop_changed_shards().items()]
+        if len(puts) > 0:
+            self._put_many(puts)
 
-    def _read_manifest(self, bundle_name, version):
+    def _read_manifest_bytes(self, bundle_name, version):
         subpath = self._ph.path_for_manifest_for_bundle_version(bundle_name,
                                                                 version)
-        bytes = self._read(subpath).decode('utf-8')
-        if bytes is not None:
-            return ZincManifest.from_bytes(bytes)
-        else:
-            return None
+        return self._read(subpath)
 
     def _write_manifest(self, manifest, raw=True, gzip=True):
         subpath = self._ph.path_for_manifest(manifest)
@@ -351,14 +734,27 @@ class ZincCatalog(ZincAbstractCatalog):
         meta = self._storage.get_meta(subpath)
         return meta
 
-    def _write_archive(self, bundle_name, version, src_path, flavor=None):
+    def _write_archive(self, bundle_name, version, src, flavor=None):
+        """Writes an archive from `src`, which is either a path or a readable
+        file-like object."""
         subpath = self._ph.path_for_archive_for_bundle_version(bundle_name,
                                                                version,
                                                                flavor=flavor)
-        with open(src_path, 'rb') as src_file:
-            self._storage.put(subpath, src_file)
+        if hasattr(src, 'read'):
+            self._storage.put(subpath, src)
+        else:
+            with open(src, 'rb') as src_file:
+                self._storage.put(subpath, src_file)
         return subpath
 
+    def _open_archive_for_write(self, bundle_name, version, flavor=None):
+        """Returns a context manager providing a writable file-like object for
+        streaming an archive directly to storage."""
+        subpath = self._ph.path_for_archive_for_bundle_version(bundle_name,
+                                                               version,
+                                                               flavor=flavor)
+        return self._storage.open_for_write(subpath)
+
     def _read_archive(self, bundle_name, version, flavor=None):
         subpath = self._ph.path_for_archive_for_bundle_version(bundle_name,
                                                                version,
@@ -373,13 +769,104 @@ class ZincCatalog(ZincAbstractCatalog):
     # "Public" Methods
 
     def save(self):
-        self._write_index(self.index)
+        self._saved_version_tokens = dict()
+        # New object references are written before the index and removed ones
+        # after it, so the references never miss an object of the index.
+        self._write_object_refs()
+        if self._journal:
+            self._append_journal(self.index)
+        else:
+            self._write_index(self.index)
+        if self._object_refs is not None:
+            self._object_refs.apply_removals()
+            self._write_object_refs()
+
+    @contextmanager
+    def transaction(self):
+        """Applies all index changes made inside the block with a single lock
+        acquisition, reload and index write. If the block raises, all of its
+        changes are discarded. Nested transactions join the outer one."""
+        if self._in_transaction:
+            yield self
+            return
+        self._in_transaction = True
+        try:
+            with self.lock():
+                yield self
+        finally:
+            self._in_transaction = False
+
+    @_ensure_index_lock
+    def rebuild_object_refs(self):
+        """Builds the object reference index from the manifests of all bundle
+        versions. Once a catalog has an object reference index, it is kept up
+        to date by `update_bundle` and `delete_bundle_version`."""
+        refs = ObjectRefs()
+        bundle_versions = [(bundle_name, version)
+                           for bundle_name in self.index.bundle_names()
+                           for version in self.index.versions_for_bundle(bundle_name)]
+        manifests = self.get_manifests(bundle_versions)
+        for (bundle_name, version), manifest in zip(bundle_versions, manifests):
+            if manifest is None:
+                log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
+                continue
+            refs.add_refs(bundle_name, version, manifest.shas())
+
+        changed = refs.pop_changed_shards()
+        puts = [(self._ph.path_for_object_refs_shard(shard), bytes)
+                for shard, bytes in changed.items()]
+        self._put_many(puts)
+        for shard in self._object_refs_shard_names():
+            if shard not in changed:
+                self._storage.delete(self._ph.path_for_object_refs_shard(shard))
+        self._storage.puts(self._ph.path_for_object_refs_info(),
+                           json.dumps({'format': OBJECT_REFS_FORMAT}).encode('utf8'))
+        # changes the index, so other catalog instances drop their refs
+        self.index.set_object_refs_generation(uuid.uuid4().hex)
+
+        self._has_object_refs = True
+        self._object_refs = ObjectRefs(load_shard=self._read_object_refs_shard)
+
+    def object_refs_for_sha(self, sha: str) -> Optional[List]:
+        """Returns the `[bundle_name, version]` pairs whose manifests
+        reference the object `sha`, or `None` if the catalog does not have an
+        object reference index."""
+        refs = self._get_object_refs()
+        return refs.refs_for_sha(sha) if refs is not None else None
+
+    @_ensure_index_lock
+    def compact_journal(self):
+        """Folds the journal into the index snapshot. Does nothing if the
+        catalog is not in journal mode."""
+        if self._journal and self.index.journal_seq is not None:
+            self._compact_journal(self.index)
 
     def get_index(self):
-        return self.index.clone(mutable=False)
+        """Returns an immutable snapshot of the index. A new snapshot is only
+        taken after the index was mutated or reloaded."""
+        index = self.index
+        if self._index_snapshot_source is not index \
+                or self._index_snapshot_generation != index.generation:
+            self._index_snapshot = index.clone(mutable=False)
+            self._index_snapshot_source = index
+            self._index_snapshot_generation = index.generation
+        return self._index_snapshot
+
+    @property
+    def manifest_cache(self) -> utils.LRUCache:
+        return self._manifests
 
     def get_manifest(self, bundle_name: str, version: int) -> ZincManifest:
-        return self._read_manifest(bundle_name, version)
+        key = (bundle_name, int(version))
+        manifest = self._manifests.get(key)
+        if manifest is None:
+            bytes = self._read_manifest_bytes(bundle_name, version)
+            if bytes is None:
+                return None
+            manifest = ZincManifest.from_bytes(bytes.decode('utf-8'), mutable=False,
+                                               trusted=self._trusted_reads)
+            self._manifests.put(key, manifest, size=len(bytes))
+        return manifest
 
     @_ensure_index_lock
     def update_bundle(self, new_manifest: ZincManifest):
@@ -394,13 +881,21 @@ class ZincCatalog(ZincAbstractCatalog):
         if new_manifest.version > next_version:
             raise ValueError("Unexpected manifest version.")
 
-        # verify all files in the filelist exist in the repo
+        # verify all files in the filelist exist in the repo. Objects referenced
+        # by the latest version of the bundle are known to exist.
+
+        known_shas = set()
+        latest_manifest = self.manifest_for_bundle(new_manifest.bundle_name)
+        if latest_manifest is not None:
+            known_shas.update(latest_manifest.shas())
 
         missing_shas = list()
         info_by_path = dict()
 
         for path in new_manifest.files.keys():
             sha = new_manifest.sha_for_file(path)
+            if sha in known_shas:
+                continue
             file_info = self._get_file_info(sha)
             if file_info is None:
                 missing_shas.append(sha)
@@ -417,39 +912,64 @@ class ZincCatalog(ZincAbstractCatalog):
 
         self._write_manifest(new_manifest)
 
+        # the manifest was just written, so it does not need to be read back
+        # and validated
+        manifest = new_manifest.clone(mutable=False)
+        self._manifests.put((manifest.bundle_name, manifest.version), manifest,
+                            size=len(manifest.to_bytes()))
+
         # update catalog index
 
         self.index.add_version_for_bundle(new_manifest.bundle_name,
-                                          new_manifest.version)
+                                          new_manifest.version,
+                                          new_manifest.digest)
 
-    def import_path(self, src_path: str):
+        refs = self._get_object_refs()
+        if refs is not None:
+            refs.add_refs(new_manifest.bundle_name, new_manifest.version,
+                          new_manifest.shas())
 
-        sha = utils.sha1_for_path(src_path)
+    def import_path(self, src_path: str, sha: Optional[str] = None):
+        """Imports the file at `src_path` and returns its file info. If `sha` is
+        given and the object already exists, the file is not read at all."""
 
-        file_info = self._get_file_info(sha)
-        if file_info is not None:
-            return file_info
+        if sha is not None:
+            file_info = self._get_file_info(sha)
+            if file_info is not None:
+                return file_info
 
-        # gzip the file first, and see if it passes the compression threshhold
-        # TODO: this is stupid inefficient
+        # Hash and gzip the file in a single pass. The gzipped copy is only
+        # uploaded if it passes the compression threshhold.
         with tempfile.NamedTemporaryFile() as tmp_file:
-            src_path_gz = tmp_file.name
-            with open(src_path, 'rb') as src_file:
-                tmp_file.write(utils.gzip_bytes(src_file.read()))
+            actual_sha = utils.sha1_and_gzip_path(src_path, tmp_file)
             tmp_file.flush()
 
-            src_size = os.path.getsize(src_path)
-            src_gz_size = os.path.getsize(src_path_gz)
-            if src_size > 0 and float(src_gz_size) / src_size <= self.config.gzip_threshhold:
-                final_src_path = src_path_gz
-                final_src_size = src_gz_size
-                format = Formats.GZ
-            else:
-                final_src_path = src_path
-                final_src_size = src_size
-                format = Formats.RAW
+            if sha is None:
+                sha = actual_sha
+                file_info = self._get_file_info(sha)
+                if file_info is not None:
+                    return file_info
+            elif actual_sha != sha:
+                raise Exception("File changed during import: %s" % (src_path))
+
+            return self._import_gzipped(src_path, sha, tmp_file.name)
+
+    def _import_gzipped(self, src_path: str, sha: str, src_path_gz: str):
+        """Imports the file at `src_path` as the object `sha`, given its
+        gzipped copy at `src_path_gz`, and returns its file info."""
+
+        src_size = os.path.getsize(src_path)
+        src_gz_size = os.path.getsize(src_path_gz)
+        if src_size > 0 and float(src_gz_size) / src_size <= self.config.gzip_threshhold:
+            final_src_path = src_path_gz
+            final_src_size = src_gz_size
+            format = Formats.GZ
+        else:
+            final_src_path = src_path
+            final_src_size = src_size
+            format = Formats.RAW
 
-            imported_path = self._write_file(sha, final_src_path, format=format)
+        imported_path = self._write_file(sha, final_src_path, format=format)
 
         file_info = {
             'sha': sha,
@@ -462,7 +982,12 @@ class ZincCatalog(ZincAbstractCatalog):
 
     @_ensure_index_lock
     def delete_bundle_version(self, bundle_name: str, version: int):
+        refs = self._get_object_refs()
+        manifest = self.get_manifest(bundle_name, version) if refs is not None else None
         self.index.delete_bundle_version(bundle_name, version)
+        self._manifests.pop((bundle_name, int(version)))
+        if manifest is not None:
+            refs.remove_refs(bundle_name, version, manifest.shas())
 
     @_ensure_index_lock
     def update_distribution(self, distribution_name: str, bundle_name: str, bundle_version: int, save_previous: bool = True):
@@ -510,7 +1035,24 @@ class ZincCatalog(ZincAbstractCatalog):
     def clean(self, dry_run: bool = False):
         verb = 'Would remove' if dry_run else 'Removing'
 
-        bundle_descriptors = self.bundle_descriptors()
+        # Readers of a journaled catalog see the last index snapshot, which
+        # can still reference versions deleted in the journal since.
+        if not dry_run:
+            self.compact_journal()
+
+        # Manifests and archives are named after their bundle version, so
+        # which ones are live is known from the index alone.
+        live_versions = set((bundle_name, version)
+                            for bundle_name in self.index.bundle_names()
+                            for version in self.index.versions_for_bundle(bundle_name))
+
+        def is_live(bundle_descr):
+            try:
+                bundle_name = helpers.bundle_id_from_bundle_descriptor(bundle_descr)
+                version = helpers.bundle_version_from_bundle_descriptor(bundle_descr)
+            except ValueError:
+                return False
+            return (bundle_name, version) in live_versions
 
         # 1. scan manifests for ones that aren't in index
 
@@ -522,7 +1064,7 @@ class ZincCatalog(ZincAbstractCatalog):
                 remove = True
             else:
                 bundle_descr = f.split(".")[0]
-                if bundle_descr not in bundle_descriptors:
+                if not is_live(bundle_descr):
                     remove = True
 
             if remove:
@@ -541,7 +1083,7 @@ class ZincCatalog(ZincAbstractCatalog):
                 remove = True
             else:
                 bundle_descr = f.split(".")[0]
-                if bundle_descr not in bundle_descriptors:
+                if not is_live(bundle_descr):
                     remove = True
 
             if remove:
@@ -552,13 +1094,15 @@ class ZincCatalog(ZincAbstractCatalog):
 
         # 3. clean objects
 
-        all_objects = set()
-        for bundle_desc in bundle_descriptors:
-            manifest = self.manifest_for_bundle_descriptor(bundle_desc)
-            if manifest is None:
-                continue
-            for f, meta in manifest.files.items():
-                all_objects.add(meta['sha'])
+        refs = self._get_object_refs()
+        if refs is not None:
+            all_objects = refs.referenced_shas(self._object_refs_shard_names())
+        else:
+            all_objects = set()
+            for manifest in self.get_manifests(sorted(live_versions)):
+                if manifest is None:
+                    continue
+                all_objects.update(manifest.shas())
 
         dir = self._ph.objects_dir
         for path in self._storage.list(dir):
@@ -571,3 +1115,24 @@ class ZincCatalog(ZincAbstractCatalog):
                 log.info("%s %s" % (verb, subpath))
                 if not dry_run:
                     self._storage.delete(subpath)
+
+        # 4. clean index shards which the index root does not reference
+
+        root_path = self._ph.path_for_index_root()
+        if self._storage.get_meta(root_path) is not None:
+            root = json.loads(self._read(root_path).decode('utf-8'))
+            live_shards = set(os.path.basename(self._ph.path_for_index_shard(shard, digest))
+                              for shard, digest in root['shards'].items())
+            # a reader may still use a root as old as its max-age
+            min_mtime = time.time() - defaults['catalog_index_max_age_seconds']
+            dir = self._ph.index_shards_dir
+            for f in self._storage.list(dir):
+                if f in live_shards or (f.endswith('.gz') and f[:-3] in live_shards):
+                    continue
+                subpath = os.path.join(dir, f)
+                mtime = self._storage.get_meta(subpath).get('mtime')
+                if mtime is None or mtime > min_mtime:
+                    continue
+                log.info("%s %s" % (verb, subpath))
+                if not dry_run:
+                    self._storage.delete(subpath)
@@ -12,6 +12,9 @@ from zinc.utils import canonical_path
 from zinc.models import ZincFlavorSpec
 from zinc.formats import Formats
 from zinc.client import ZincClientConfig
+from zinc.defaults import defaults
+from zinc.hashcache import HashCache
+from zinc.ignore import ZincIgnore
 import zinc.client as client
 import zinc.helpers as helpers
 import zinc.utils as utils
@@ -123,10 +126,16 @@ def parse_multi_version_ish(catalog, bundle_name, version_list):
 
 
 def bundle_update(catalog, bundle_name, path, flavors=None, force=False,
-                  skip_master_archive=True):
+                  skip_master_archive=True, jobs=None, archive_jobs=None,
+                  hash_cache_path=None):
+    hash_cache = None
+    if hash_cache_path is not None:
+        hash_cache = HashCache.from_path(hash_cache_path)
     manifest = client.create_bundle_version(catalog, bundle_name, path,
                                             flavor_spec=flavors, force=force,
-                                            skip_master_archive=skip_master_archive)
+                                            skip_master_archive=skip_master_archive,
+                                            jobs=jobs, archive_jobs=archive_jobs,
+                                            hash_cache=hash_cache)
     #print("Updated %s v%d" % (manifest.bundle_name, manifest.version))
     # TODO: add some nice human readable and machine readable output options
     print("%d" % (manifest.version))
@@ -202,13 +211,36 @@ def subcmd_catalog_create(config, cargs):
     storage_ref = cargs.storage
     catalog_id = cargs.catalog_id
     storage_info = resolve_storage_info(config, storage_ref)
-    client.create_catalog(catalog_id=catalog_id, storage_info=storage_info)
+    client.create_catalog(catalog_id=catalog_id, storage_info=storage_info,
+                          sharded_index=cargs.sharded_index, journal=cargs.journal)
     print("Catalog '%s' successfully created." % (catalog_id))
 
 
 def subcmd_catalog_clean(config, cargs):
     catalog = get_catalog(config, cargs)
-    catalog.clean(dry_run=not cargs.force)
+    if cargs.incremental:
+        done = client.collect_garbage(catalog, time_budget=cargs.time_budget,
+                                      grace_period=cargs.grace_period,
+                                      dry_run=not cargs.force, restart=cargs.restart)
+        if not done:
+            print("Time budget used up, run again to continue.")
+    else:
+        catalog.clean(dry_run=not cargs.force)
+
+
+def subcmd_catalog_rebuild_refs(config, cargs):
+    catalog = get_catalog(config, cargs)
+    catalog.rebuild_object_refs()
+
+
+def subcmd_catalog_batch(config, cargs):
+    catalog = get_catalog(config, cargs)
+    save_previous = not cargs.no_prev_distro
+    if cargs.path == '-':
+        client.apply_batch(catalog, sys.stdin, save_previous=save_previous)
+    else:
+        with open(cargs.path, 'r') as f:
+            client.apply_batch(catalog, f, save_previous=save_previous)
 
 
 @cli_cmd
@@ -222,6 +254,16 @@ def subcmd_bundle_list(config, cargs):
                               print_sha=print_sha, flavor_name=flavor_name)
 
 
+@cli_cmd
+def subcmd_bundle_diff(config, cargs):
+    catalog = get_catalog(config, cargs)
+    bundle_name = cargs.bundle
+    from_version = parse_single_version_ish(catalog, bundle_name, cargs.from_version)
+    to_version = parse_single_version_ish(catalog, bundle_name, cargs.to_version)
+    return client.bundle_diff(catalog, bundle_name, from_version, to_version,
+                              flavor_name=cargs.flavor)
+
+
 def subcmd_bundle_update(config, cargs):
     catalog = get_catalog(config, cargs)
 
@@ -240,9 +282,13 @@ def subcmd_bundle_update(config, cargs):
     path = cargs.path
     force = cargs.force
     skip_master_archive = cargs.skip_master_archive
+    jobs = cargs.jobs
+    archive_jobs = cargs.archive_jobs
+    hash_cache_path = cargs.hash_cache
 
     bundle_update(catalog, bundle_name, path, flavors=flavors, force=force,
-                  skip_master_archive=skip_master_archive)
+                  skip_master_archive=skip_master_archive, jobs=jobs,
+                  archive_jobs=archive_jobs, hash_cache_path=hash_cache_path)
 
 
 def subcmd_bundle_clone(config, cargs):
@@ -399,13 +445,9 @@ def subcmd_debug_flavors(config, cargs):
         print('[%s]' % flavor_name)
         filter = flavors.filter_for_flavor(flavor_name)
         src_dir = cargs.path
-        for root, dirs, files in os.walk(src_dir):
-            for f in files:
-                #if f in IGNORE: continue # TODO: integrate ignore system
-                rel_dir = root[len(src_dir) + 1:]
-                rel_path = os.path.join(rel_dir, f)
-                matched = filter.match(rel_path)
-                print('%s %s' % ('+' if matched else '-', rel_path))
+        for full_path, rel_path in ZincIgnore.from_dir(src_dir).walk(src_dir):
+            matched = filter.match(rel_path)
+            print('%s %s' % ('+' if matched else '-', rel_path))
         print("")  # blank line
 
 
@@ -471,6 +513,10 @@ def main():
     parser_catalog_create.add_argument('-s', '--storage',
                                        help='Storage descriptor. Defaults to "file://."',
                                        default='.')
+    parser_catalog_create.add_argument('--sharded-index', default=False, action='store_true',
+                                       help='Write the index as shards instead of a single file.')
+    parser_catalog_create.add_argument('--journal', default=False, action='store_true',
+                                       help='Append index changes to a journal instead of rewriting the index.')
     parser_catalog_create.set_defaults(func=subcmd_catalog_create)
 
     # catalog:clean
@@ -484,8 +530,45 @@ def main():
                                       help='This command does a dry run by default. \
                                           Specifying this flag will cause files to \
                                           actually be removed.')
+    parser_catalog_clean.add_argument('--incremental', default=False, action='store_true',
+                                      help='Only hold the catalog lock while taking a snapshot \
+                                          of the index, and continue where the previous run \
+                                          stopped.')
+    parser_catalog_clean.add_argument('--time-budget', type=int, default=None,
+                                      help='With --incremental, stop after this many seconds.')
+    parser_catalog_clean.add_argument('--grace-period', type=int, default=None,
+                                      help='With --incremental, keep files written less than \
+                                          this many seconds before the snapshot. Defaults to %d.'
+                                      % (defaults['catalog_gc_grace_period']))
+    parser_catalog_clean.add_argument('--restart', default=False, action='store_true',
+                                      help='With --incremental, take a new snapshot instead of \
+                                          continuing the previous run.')
     parser_catalog_clean.set_defaults(func=subcmd_catalog_clean)
 
+    # catalog:rebuild-refs
+    parser_catalog_rebuild_refs = subparsers.add_parser('catalog:rebuild-refs',
+                                                        help='catalog:rebuild-refs help')
+    add_catalog_arg(parser_catalog_rebuild_refs)
+    add_timeout_arg(parser_catalog_rebuild_refs)
+    parser_catalog_rebuild_refs.set_defaults(func=subcmd_catalog_rebuild_refs)
+
+    # catalog:batch
+    parser_catalog_batch = subparsers.add_parser('catalog:batch',
+                                                 help='catalog:batch help')
+    add_catalog_arg(parser_catalog_batch)
+    add_timeout_arg(parser_catalog_batch)
+    parser_catalog_batch.add_argument('path', nargs='?', default='-',
+                                      help='File with one operation per line, either \
+                                          "distro:update BUNDLE DISTRO VERSION" or \
+                                          "distro:delete BUNDLE DISTRO". Reads from \
+                                          stdin if omitted or "-". All operations are \
+                                          applied with a single index write, or none \
+                                          if one fails.')
+    parser_catalog_batch.add_argument('--no-prev-distro',
+                                      default=False, action='store_true',
+                                      help='Do not preserve previous versions for distros.')
+    parser_catalog_batch.set_defaults(func=subcmd_catalog_batch)
+
     # catalog:verify
     parser_catalog_verify = subparsers.add_parser('catalog:verify',
                                                   help='catalog:verify help')
@@ -521,6 +604,19 @@ def main():
                                     help='Name of flavor.')
     parser_bundle_list.set_defaults(func=subcmd_bundle_list)
 
+    # bundle:diff
+    parser_bundle_diff = subparsers.add_parser('bundle:diff',
+                                               help='List files changed between two versions of a bundle')
+    add_catalog_arg(parser_bundle_diff)
+    add_bundle_arg(parser_bundle_diff)
+    parser_bundle_diff.add_argument('--from', dest='from_version', required=True,
+                                    help='Version to compare from.')
+    parser_bundle_diff.add_argument('--to', dest='to_version', required=True,
+                                    help='Version to compare to.')
+    parser_bundle_diff.add_argument('--flavor',
+                                    help='Name of flavor.')
+    parser_bundle_diff.set_defaults(func=subcmd_bundle_diff)
+
     # bundle:update
     parser_bundle_update = subparsers.add_parser('bundle:update',
                                                  help='bundle:update help')
@@ -537,6 +633,24 @@ def main():
                                       default=False,
                                       action='store_true',
                                       help='Update bundle even if no files changed.')
+    parser_bundle_update.add_argument('-j', '--jobs',
+                                      type=int,
+                                      default=None,
+                                      help='Number of files to import concurrently. Defaults to %d.'
+                                      % (defaults['bundle_update_jobs']))
+    parser_bundle_update.add_argument('--archive-jobs',
+                                      type=int,
+                                      default=None,
+                                      help='Number of archives to build concurrently. Defaults to %d.'
+                                      % (defaults['bundle_update_archive_jobs']))
+    parser_bundle_update.add_argument('--hash-cache',
+                                      nargs='?',
+                                      default=None,
+                                      const=defaults['bundle_update_hash_cache_path'],
+                                      metavar='PATH',
+                                      help=('Cache file hashes between runs so unchanged files are not '
+                                            're-read. Defaults to \'%s\' if PATH is omitted.'
+                                            % (defaults['bundle_update_hash_cache_path'])))
 
     parser_bundle_update_master_archive_group = parser_bundle_update.add_mutually_exclusive_group()
     parser_bundle_update_master_archive_group.add_argument('--skip-master-archive',
@@ -18,6 +18,7 @@ from .formats import Formats
 from .models import ZincModel, ZincIndex, ZincCatalogConfig
 from .storages import storage_for_url
 from .tasks.bundle_update import ZincBundleUpdateTask
+from .tasks.gc import ZincGarbageCollectTask
 from .utils import enum, memoized
 
 log = logging.getLogger(__name__)
@@ -46,7 +47,7 @@ class ZincClientConfig(ZincModel):
         self._d = d or dict()
 
     @classmethod
-    def from_bytes(cls, b, mutable=True):
+    def from_bytes(cls, b, mutable=True, trusted=False):
         d = toml.loads(b)
         return cls.from_dict(d, mutable=mutable)
 
@@ -274,6 +275,31 @@ def bundle_list(catalog: ZincCatalog, bundle_name: str, version_ish, print_sha:
     return ResultSet(results)
 
 
+def bundle_diff(catalog: ZincCatalog, bundle_name: str, from_version_ish, to_version_ish, flavor_name: str = None):
+
+    from_version = _resolve_single_bundle_version(catalog, bundle_name, from_version_ish)
+    to_version = _resolve_single_bundle_version(catalog, bundle_name, to_version_ish)
+
+    symbols = {'added': '+', 'removed': '-', 'modified': 'M'}
+
+    def pretty(r):
+        return "%s %s (%+d bytes)" % (symbols[r['change']], r['file'], r['size_delta'])
+
+    def results():
+        diffs = catalog.diff_manifests(bundle_name, from_version, to_version, flavor=flavor_name)
+        for diff in diffs:
+            d = {
+                'file': diff.path,
+                'change': diff.change,
+                'from_sha': diff.from_sha,
+                'to_sha': diff.to_sha,
+                'size_delta': diff.size_delta,
+            }
+            yield DictResult(d, pretty=pretty)
+
+    return ResultSet(results)
+
+
 def bundle_verify(catalog, bundle_name, version_ish, check_shas=True,
                   should_lock=False, **kwargs):
 
@@ -294,24 +320,22 @@ def bundle_verify(catalog, bundle_name, version_ish, check_shas=True,
 def verify_catalog(catalog, should_lock=False, **kwargs):
 
     index = catalog.get_index()
-    manifests = list()
     ph = catalog.path_helper
 
     def results():
 
         # TODO: fix private ref to _bundle_info_by_name
-        for (bundle_name, bundle_info) in index._bundle_info_by_name.items():
-            for version in bundle_info['versions']:
-                manifest_name = ph.manifest_name(bundle_name, version)
-                yield Message.info("Loading %s" % (manifest_name))
-                manifest = catalog.get_manifest(bundle_name, version)
-                if manifest is None:
-                    yield Message.error("manifest not found: %s" % (manifest_name))
-                    continue
-                manifests.append(manifest)
-
+        bundle_versions = [(bundle_name, version)
+                           for (bundle_name, bundle_info) in index._bundle_info_by_name.items()
+                           for version in bundle_info['versions']]
+        yield Message.info("Loading %d manifests" % (len(bundle_versions)))
         verified_files = set()
-        for manifest in manifests:
+        loaded = catalog.get_manifests(bundle_versions)
+        for (bundle_name, version), manifest in zip(bundle_versions, loaded):
+            manifest_name = ph.manifest_name(bundle_name, version)
+            if manifest is None:
+                yield Message.error("manifest not found: %s" % (manifest_name))
+                continue
             yield Message.info("Verifying %s-%d" % (manifest.bundle_name,
                                                     manifest.version))
             for result in _verify_bundle_with_manifest(catalog, manifest,
@@ -322,7 +346,8 @@ def verify_catalog(catalog, should_lock=False, **kwargs):
 
 
 def create_bundle_version(catalog, bundle_name, src_dir, flavor_spec=None,
-                          force=False, skip_master_archive=False):
+                          force=False, skip_master_archive=False, jobs=None,
+                          archive_jobs=None, hash_cache=None):
 
     task = ZincBundleUpdateTask()
     task.catalog = catalog
@@ -331,6 +356,9 @@ def create_bundle_version(catalog, bundle_name, src_dir, flavor_spec=None,
     task.flavor_spec = flavor_spec
     task.skip_master_archive = skip_master_archive
     task.force = force
+    task.jobs = jobs or defaults['bundle_update_jobs']
+    task.archive_jobs = archive_jobs or defaults['bundle_update_archive_jobs']
+    task.hash_cache = hash_cache
     return task.run()
 
 
@@ -353,6 +381,107 @@ def delete_distribution(catalog, distribution_name, bundle_name,
                                 delete_previous=delete_previous)
 
 
+def collect_garbage(catalog, time_budget=None, grace_period=None, dry_run=False,
+                    restart=False):
+    """Runs a slice of an incremental garbage collection, see
+    `ZincGarbageCollectTask`. Returns `True` once the collection is complete."""
+    task = ZincGarbageCollectTask(catalog=catalog,
+                                  time_budget=time_budget,
+                                  grace_period=grace_period,
+                                  dry_run=dry_run,
+                                  restart=restart)
+    return task.run()
+
+
+def _parse_version_ish(version_string):
+    if version_string.isdigit():
+        return int(version_string)
+    if version_string in SymbolicSingleBundleVersions or \
+            version_string.startswith(BundleVersionDistroPrefix):
+        return version_string
+    raise ValueError("Invalid version '%s'" % (version_string))
+
+
+def apply_batch(catalog, lines, save_previous=True):
+    """Applies distro operations, one per line, in a single catalog
+    transaction. Valid operations are:
+
+        distro:update BUNDLE DISTRO VERSION
+        distro:delete BUNDLE DISTRO
+
+    VERSION is a version number, `:latest` or `@DISTRO`. Blank lines and lines
+    starting with `#` are ignored. Every line is checked before any operation
+    is applied; if any line is invalid, none are applied.
+    """
+    with catalog.transaction():
+        index = catalog.index
+        # distro versions as they will be after the preceding lines, so every
+        # line is checked against the effect of the lines before it
+        pending = dict()
+
+        def distro_version(bundle_name, distro_name):
+            if (bundle_name, distro_name) in pending:
+                return pending[(bundle_name, distro_name)]
+            return index.version_for_bundle(bundle_name, distro_name)
+
+        operations = list()
+        for line_number, line in enumerate(lines, 1):
+            args = line.split()
+            if len(args) == 0 or args[0].startswith('#'):
+                continue
+            command = args[0]
+            if command == 'distro:update' and len(args) == 4:
+                bundle_name, distro_name, version_ish = args[1:]
+                errors = helpers.distro_name_errors(distro_name)
+                if len(errors) > 0:
+                    raise ValueError("Line %d: %s" % (line_number, errors[0]))
+                try:
+                    version_ish = _parse_version_ish(version_ish)
+                except ValueError as e:
+                    raise ValueError("Line %d: %s" % (line_number, e))
+                versions = index.versions_for_bundle(bundle_name)
+                if len(versions) == 0:
+                    raise ValueError("Line %d: unknown bundle '%s'" % (line_number, bundle_name))
+                if isinstance(version_ish, int):
+                    version = version_ish
+                elif version_ish == SymbolicBundleVersions.LATEST:
+                    version = versions[-1]
+                else:
+                    version = distro_version(bundle_name, version_ish[1:])
+                if version is None or version not in versions:
+                    raise ValueError("Line %d: cannot resolve version '%s' of bundle '%s'" % (
+                        line_number, args[3], bundle_name))
+                if save_previous:
+                    cur_version = distro_version(bundle_name, distro_name)
+                    if cur_version is not None and cur_version != version:
+                        pending[(bundle_name, helpers.distro_previous_name(distro_name))] = cur_version
+                pending[(bundle_name, distro_name)] = version
+                operations.append((command, bundle_name, distro_name, version))
+            elif command == 'distro:delete' and len(args) == 3:
+                bundle_name, distro_name = args[1:]
+                if len(index.versions_for_bundle(bundle_name)) == 0:
+                    raise ValueError("Line %d: unknown bundle '%s'" % (line_number, bundle_name))
+                if distro_version(bundle_name, distro_name) is None:
+                    raise ValueError("Line %d: unknown distro '%s' of bundle '%s'" % (
+                        line_number, distro_name, bundle_name))
+                # the previous distro is deleted along with it, if there is one
+                prev_distro = helpers.distro_previous_name(distro_name)
+                delete_previous = distro_version(bundle_name, prev_distro) is not None
+                pending[(bundle_name, distro_name)] = None
+                pending[(bundle_name, prev_distro)] = None
+                operations.append((command, bundle_name, distro_name, delete_previous))
+            else:
+                raise ValueError("Line %d: invalid operation '%s'" % (line_number, line.strip()))
+
+        for command, bundle_name, distro_name, arg in operations:
+            if command == 'distro:update':
+                catalog.update_distribution(distro_name, bundle_name, arg,
+                                            save_previous=save_previous)
+            else:
+                catalog.delete_distribution(distro_name, bundle_name,
+                                            delete_previous=arg)
+
+
 def clone_bundle(catalog, bundle_name, version, root_path=None, bundle_dir_name=None, flavor=None):
 
     assert catalog
@@ -449,7 +578,7 @@ def catalog_ref_split(catalog_ref):
 
 
 # TODO: fix cloning between this and zinc.services.simple
-def create_catalog(catalog_id=None, storage_info=None):
+def create_catalog(catalog_id=None, storage_info=None, sharded_index=False, journal=False):
     assert catalog_id
     assert storage_info
 
@@ -463,7 +592,8 @@ def create_catalog(catalog_id=None, storage_info=None):
     catalog_storage.puts(defaults['catalog_index_name'],
                          ZincIndex(catalog_id).to_bytes())
 
-    catalog = ZincCatalog(storage=catalog_storage)
+    catalog = ZincCatalog(storage=catalog_storage, sharded_index=sharded_index,
+                          journal=journal)
     catalog.save()
 
 
@@ -598,9 +728,9 @@ def _verify_archive(catalog, manifest, flavor=None, check_shas=True):
 
         tar = tarfile.open(fileobj=fileobj)
 
-        # Note: getmembers and getnames return objects in the same order
-        members = tar.getmembers()
-        member_names = tar.getnames()
+        members_by_name = dict()
+        for member in tar.getmembers():
+            members_by_name.setdefault(member.name, member)
 
         found_error = False
 
@@ -608,7 +738,8 @@ def _verify_archive(catalog, manifest, flavor=None, check_shas=True):
             sha = manifest.sha_for_file(file)
             format, info = manifest.get_format_info_for_file(file, preferred_formats=defaults['catalog_preferred_formats'])
             target_member_name = helpers.append_file_extension_for_format(sha, format)
-            if target_member_name not in member_names:
+            member = members_by_name.get(target_member_name)
+            if member is None:
                 found_error = True
                 yield Message.error('File \'%s\' not found in %s.'
                                     % (target_member_name,
@@ -616,7 +747,6 @@ def _verify_archive(catalog, manifest, flavor=None, check_shas=True):
                                                                       manifest.version,
                                                                       flavor=flavor)))
             else:
-                member = members[member_names.index(target_member_name)]
                 if check_shas:
                     f = tar.extractfile(member)
                     b = f.read()
@@ -11,12 +11,29 @@ Configurations:
 :catalog_index_name: The name of the catalog index file.
 :catalog_index_max_age_seconds: The maximum length of time for which a catalog index may be cached. It is the responsibility of the storage backend to handle.  Some backends (such as the 'FileSystemStorageBackend') may ignore this setting.
 :catalog_write_legacy_index: Specify that the legacy 'index.json' should be written in addition to the current catalog index file.
+:catalog_index_sharded: Write the catalog index as a small root ('index/root.json') plus shards containing the bundles, so a change only rewrites the affected shard. Shards are named after their content, so older roots stay readable until `clean` removes the shards no longer referenced. A catalog stays sharded once it was written sharded.
+:catalog_index_shard_prefix_length: Number of hex digits of the SHA1 of the bundle name used to assign bundles to index shards.
+:catalog_index_journal: Save index changes as small records appended to a journal ('journal/') instead of rewriting the index. Readers replay the journal over the last index snapshot. Clients reading the catalog index file directly only see changes once the journal is compacted. A catalog stays journaled once it was written journaled.
+:catalog_index_journal_compaction_threshold: Number of journal records after which the journal is folded into a new index snapshot.
+:catalog_write_single_file_index: Specify that a sharded catalog should also write the complete index to the catalog index file for clients that do not support shards. Requires reading all shards on every write, so it is off by default; the catalog index file then only tells readers to use the shards.
 :catalog_config_name: The name of the catalog index file (currently unused).
 :catalog_preferred_formats: An ordered list of the formats to try when locating a file. Must be a (non-strict) subset of 'catalog_valid_formats'.
 :catalog_valid_formats: A list of valid formats for objects in the catalog.
 :catalog_lock_timeout: Timeout for acquiring a lock on the catalog via a coordinator.
 :catalog_prev_distro_prefix: The prefix to use when writing the previous distro.
+:catalog_read_jobs: Maximum number of manifests a catalog fetches concurrently when loading many at once.
+:catalog_write_jobs: Maximum number of files a catalog writes concurrently, for example the raw and gzipped copies of the catalog index.
+:catalog_validate_reads: Validate indexes and manifests read from a catalog against their schemas. They are only written by zinc, so this may be disabled to speed up loading them.
+:catalog_manifest_cache_size: Maximum number of manifests a catalog keeps in memory.
+:catalog_manifest_cache_max_bytes: Maximum total size (of the serialized manifests) of the manifest cache, or `None` for no limit.
+:catalog_gc_grace_period: Files written less than this many seconds before an incremental garbage collection started are never removed by it, to protect bundle updates in progress.
+:catalog_gc_batch_size: Number of files an incremental garbage collection deletes at once.
 :storage_aws_read_retry_count: Number of times to retry an operation using an 'S3StorageBackend'.
+:storage_aws_multipart_part_size: Size in bytes of the parts used when streaming uploads to an 'S3StorageBackend'. S3 requires at least 5 MB.
+:bundle_update_jobs: Number of files to import concurrently when updating a bundle.
+:bundle_update_archive_jobs: Number of archives to build and upload concurrently when updating a bundle.
+:bundle_update_scratch_max_bytes: Size in bytes of the gzipped archive members a bundle update keeps on scratch disk for reuse by other archives. Members currently being added to an archive are kept regardless. If the members of a bundle do not fit, its archives are built in a single pass instead; files imported by the update may then be compressed a second time for the archives.
+:bundle_update_hash_cache_path: Default location of the file hash cache used when updating a bundle.
 """
 
 from .formats import Formats
@@ -28,9 +45,26 @@ defaults['zinc_format'] = '1'
 defaults['catalog_index_name'] = 'catalog.json'
 defaults['catalog_index_max_age_seconds'] = 300
 defaults['catalog_write_legacy_index'] = True  # TODO: move this to config once config is implemented
+defaults['catalog_index_sharded'] = False
+defaults['catalog_index_shard_prefix_length'] = 2
+defaults['catalog_write_single_file_index'] = False
+defaults['catalog_index_journal'] = False
+defaults['catalog_index_journal_compaction_threshold'] = 100
 defaults['catalog_config_name'] = 'config.json'
 defaults['catalog_preferred_formats'] = [Formats.GZ, Formats.RAW]
 defaults['catalog_valid_formats'] = defaults['catalog_preferred_formats']
 defaults['catalog_lock_timeout'] = 60
 defaults['catalog_prev_distro_prefix'] = '_'
+defaults['catalog_read_jobs'] = 8
+defaults['catalog_write_jobs'] = 4
+defaults['catalog_validate_reads'] = True
+defaults['catalog_manifest_cache_size'] = 128
+defaults['catalog_manifest_cache_max_bytes'] = None
+defaults['catalog_gc_grace_period'] = 24 * 60 * 60
+defaults['catalog_gc_batch_size'] = 1000
 defaults['storage_aws_read_retry_count'] = 3
+defaults['storage_aws_multipart_part_size'] = 8 * 1024 * 1024
+defaults['bundle_update_jobs'] = 1
+defaults['bundle_update_archive_jobs'] = 2
+defaults['bundle_update_scratch_max_bytes'] = 256 * 1024 * 1024
+defaults['bundle_update_hash_cache_path'] = '~/.zinc-hashcache'
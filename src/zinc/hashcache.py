@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.hashcache
+~~~~~~~~~~~~~~
+
+This module implements a persistent cache of file hashes. Entries are keyed by
+path and are only valid while the file's size, mtime and inode are unchanged,
+so unchanged files do not need to be read again on the next bundle update.
+
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from atomicwrites import atomic_write
+
+import zinc.utils as utils
+
+HASH_CACHE_FORMAT = 1
+
+
+def _stat_key(st: os.stat_result):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class HashCache(object):
+
+    def __init__(self, path: str = None):
+        self._path = utils.canonical_path(path) if path is not None else None
+        self._entries = dict()  # type: Dict[str, Dict]
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._path
+
+    @classmethod
+    def from_path(cls, path: str):
+        """Loads the cache at `path`. A missing or unreadable cache file
+        results in an empty cache."""
+        cache = cls(path=path)
+        try:
+            with open(cache.path, 'r') as f:
+                d = json.load(f)
+        except (IOError, ValueError):
+            return cache
+        if d.get('format') == HASH_CACHE_FORMAT:
+            cache._entries = d.get('files') or dict()
+        return cache
+
+    def to_dict(self) -> Dict:
+        return {
+            'format': HASH_CACHE_FORMAT,
+            'files': self._entries,
+        }
+
+    def save(self) -> None:
+        assert self._path
+        with self._lock:
+            if not self._dirty:
+                return
+            utils.makedirs(os.path.dirname(self._path))
+            with atomic_write(self._path, mode='w', overwrite=True) as f:
+                json.dump(self.to_dict(), f)
+            self._dirty = False
+
+    def get(self, path: str, st: os.stat_result) -> Optional[Dict]:
+        """Returns the cached file info for `path` if the cached entry matches
+        `st`, otherwise `None`. The file info has the keys `sha`, `format` and
+        `size`."""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry['stat'] != _stat_key(st):
+            return None
+        return {
+            'sha': entry['sha'],
+            'format': entry['format'],
+            'size': entry['size'],
+        }
+
+    def set(self, path: str, st: os.stat_result, file_info: Dict) -> None:
+        """Records `file_info` for `path`. `st` must be the result of
+        `os.stat` taken *before* the file was read."""
+        entry = {
+            'stat': _stat_key(st),
+            'sha': file_info['sha'],
+            'format': file_info['format'],
+            'size': file_info['size'],
+        }
+        with self._lock:
+            if self._entries.get(path) != entry:
+                self._entries[path] = entry
+                self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.ignore
+~~~~~~~~~~~
+
+This module implements the ignore system used when walking bundle source
+directories. Patterns are read from a `.zincignore` file at the root of the
+source directory and follow gitignore semantics:
+
+ - blank lines and lines starting with `#` are skipped
+ - a leading `!` re-includes paths excluded by an earlier pattern
+ - a trailing `/` only matches directories
+ - patterns without a `/` match at any depth, others are relative to the root
+ - `*` and `?` do not match `/`, `**` matches any number of directories
+
+Ignored directories are pruned from the walk, so nothing inside them is listed.
+
+"""
+
+import os
+import re
+from typing import List
+
+IGNORE_FILENAME = '.zincignore'
+
+DEFAULT_IGNORE_PATTERNS = ['.DS_Store', IGNORE_FILENAME]
+
+
+def _translate_glob(glob: str) -> str:
+    """Translates a gitignore glob to a regex."""
+
+    res = ''
+    i, n = 0, len(glob)
+    while i < n:
+        c = glob[i]
+        if glob.startswith('**/', i):
+            res += '(?:.*/)?'
+            i += 3
+            continue
+        elif glob.startswith('**', i) and i + 2 == n:
+            res += '.*'
+            i += 2
+            continue
+        elif c == '*':
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res += re.escape(glob[i])
+        elif c == '[':
+            j = glob.find(']', i + 2 if glob.startswith('[!', i) else i + 1)
+            if j == -1:
+                res += '\\['
+            else:
+                stuff = glob[i + 1:j].replace('\\', '\\\\')
+                if stuff.startswith('!'):
+                    stuff = '^' + stuff[1:]
+                res += '[%s]' % (stuff)
+                i = j
+        else:
+            res += re.escape(c)
+        i += 1
+    return res
+
+
+class IgnoreRule(object):
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith('/')
+        if self.dir_only:
+            pattern = pattern.rstrip('/')
+
+        if '/' in pattern:
+            # anchored to the root
+            prefix = ''
+            pattern = pattern.lstrip('/')
+        else:
+            prefix = '(?:.*/)?'
+
+        self._regex = re.compile('%s%s\\Z' % (prefix, _translate_glob(pattern)))
+
+    def match(self, rel_path: str, is_dir: bool = False) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self._regex.match(rel_path) is not None
+
+
+class ZincIgnore(object):
+
+    def __init__(self, patterns: List[str] = None):
+        self._rules = list()
+        for pattern in DEFAULT_IGNORE_PATTERNS + (patterns or []):
+            self.add_pattern(pattern)
+
+    @classmethod
+    def from_dir(cls, src_dir: str):
+        """Returns the ignore rules for `src_dir`, including the contents of
+        its `.zincignore` file if there is one."""
+        ignore_path = os.path.join(src_dir, IGNORE_FILENAME)
+        if not os.path.exists(ignore_path):
+            return cls()
+        with open(ignore_path, 'r') as f:
+            return cls(f.read().splitlines())
+
+    def add_pattern(self, pattern: str):
+        if not pattern.endswith('\\ '):
+            pattern = pattern.rstrip()
+        if len(pattern) == 0 or pattern.startswith('#'):
+            return
+        self._rules.append(IgnoreRule(pattern))
+
+    def _match(self, rel_path: str, is_dir: bool) -> bool:
+        # the last matching rule wins
+        for rule in reversed(self._rules):
+            if rule.match(rel_path, is_dir=is_dir):
+                return not rule.negate
+        return False
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """Tests if `rel_path` is ignored. As with git, a path can not be
+        re-included if one of its parent directories is ignored."""
+        parts = rel_path.split('/')
+        for i in range(1, len(parts)):
+            if self._match('/'.join(parts[:i]), True):
+                return True
+        return self._match(rel_path, is_dir)
+
+    def walk(self, src_dir: str):
+        """Yields `(full_path, rel_path)` for all files in `src_dir` which are
+        not ignored. Ignored directories are not descended into."""
+        for root, dirs, files in os.walk(src_dir):
+            rel_dir = root[len(src_dir) + 1:]
+            dirs[:] = [d for d in dirs
+                       if not self._match(os.path.join(rel_dir, d), True)]
+            for f in files:
+                rel_path = os.path.join(rel_dir, f)
+                if not self._match(rel_path, False):
+                    yield os.path.join(root, f), rel_path
@@ -12,15 +12,20 @@ This module implements models that represent core concepts of the Zinc system.
 """
 
 
+import copy
+import hashlib
 import json
-from collections import MutableMapping
+import re
+import sys
+import threading
+from collections import MutableMapping, namedtuple
 from functools import wraps
 from pkg_resources import resource_string
 import jsonschema
-from typing import Dict
+from typing import Dict, List, Optional
 
 from .defaults import defaults
-from .pathfilter import PathFilter
+from .pathfilter import PathFilter, PathFilterGroup
 
 
 def mutable_only(f):
@@ -28,23 +33,48 @@ def mutable_only(f):
     def func(self, *args, **kwargs):
         if not self.is_mutable:
             raise TypeError("Can't modify immutable instance")
+        self._generation += 1
         return f(self, *args, **kwargs)
     return func
 
 
+def journaled(f):
+    """Records calls of a `ZincIndex` method in the pending journal
+    operations, so they can be replayed with `apply_journal_ops`."""
+    @wraps(f)
+    def func(self, *args):
+        self._journal_depth += 1
+        try:
+            result = f(self, *args)
+        finally:
+            self._journal_depth -= 1
+        # nested calls are replayed by the outermost one
+        if self._journal_depth == 0 and not self._replaying_journal:
+            self._pending_journal_ops.append([f.__name__, list(args)])
+        return result
+    return func
+
+
 class ZincModel:
     """Base class for all Zinc model objects. Provides methods for reading and
     writing (JSON) and support for immutability."""
 
     _schema = None
+    _validator = None
 
     def __init__(self, mutable: bool = True):
         self._mutable = mutable
+        self._generation = 0
 
     @property
     def is_mutable(self) -> bool:
         return self._mutable
 
+    @property
+    def generation(self) -> int:
+        """A counter that is incremented by every mutating method."""
+        return self._generation
+
     def to_bytes(self) -> bytes:
         return json.dumps(self.to_dict()).encode('utf8')
 
@@ -65,24 +95,39 @@ class ZincModel:
         return cls._schema
 
     @classmethod
-    def from_bytes(cls, b: str, mutable: bool = True):
+    def validator(cls):
+        """Returns the validator for the schema of the model, which is only
+        built once."""
+        if cls._validator is None:
+            schema = cls.schema()
+            if schema is not None:
+                jsonschema.Draft4Validator.check_schema(schema)
+                cls._validator = jsonschema.Draft4Validator(schema)
+        return cls._validator
+
+    @classmethod
+    def from_bytes(cls, b: str, mutable: bool = True, trusted: bool = False):
+        """Parses `b`. Unless `trusted` is set, the data is validated against
+        the schema of the model first."""
         d = json.loads(b)
-        schema = cls.schema()
-        if schema is not None:
-            jsonschema.validate(d, schema)
+        if not trusted:
+            validator = cls.validator()
+            if validator is not None:
+                validator.validate(d)
         return cls.from_dict(d, mutable=mutable)
 
     @classmethod
-    def from_path(cls, p: str, mutable: bool = True):
+    def from_path(cls, p: str, mutable: bool = True, trusted: bool = False):
         with open(p, 'r') as f:
-            return cls.from_bytes(f.read(), mutable=mutable)
+            return cls.from_bytes(f.read(), mutable=mutable, trusted=trusted)
 
     def write(self, path: str) -> None:
         with open(path, 'wb') as f:
             f.write(self.to_bytes())
 
     def clone(self, mutable=True):
-        d = self.to_dict()
+        # deep copy, so the clone does not share any state with the original
+        d = copy.deepcopy(self.to_dict())
         o = self.__class__.from_dict(d, mutable=mutable)
         return o
 
@@ -92,22 +137,147 @@ class ZincModel:
 
 # ZincIndex
 
+INDEX_LAYOUT_SHARDED = 'sharded'
+
+
+def index_shard_for_bundle(bundle_name: str, prefix_length: int) -> str:
+    """Returns the name of the index shard containing `bundle_name`, which is
+    a prefix of the SHA1 of the bundle name."""
+    return hashlib.sha1(bundle_name.encode('utf8')).hexdigest()[:prefix_length]
+
+
+def index_shard_to_bytes(bundles: Dict) -> bytes:
+    return json.dumps({'bundles': bundles}, sort_keys=True).encode('utf8')
+
+
+class _ShardedBundleInfo(MutableMapping):
+    """Maps bundle names to bundle info like the `dict` of an unsharded index,
+    but only loads a shard once a bundle in it is accessed."""
+
+    def __init__(self, shard_digests: Dict, load_shard, prefix_length: int):
+        # digests of the shards as stored, which are the non-empty shards
+        self._shard_digests = dict(shard_digests)
+        self._load_shard = load_shard
+        self._shards = dict()
+        self.prefix_length = prefix_length
+
+    @classmethod
+    def from_dict(cls, bundles: Dict, prefix_length: int, load_shard=None):
+        """Splits `bundles` into shards. All shards are considered unsaved."""
+        info = cls(dict(), load_shard, prefix_length)
+        for bundle_name, bundle_info in bundles.items():
+            info[bundle_name] = bundle_info
+        return info
+
+    def _get_shard(self, shard: str) -> Dict:
+        bundles = self._shards.get(shard)
+        if bundles is None:
+            if shard in self._shard_digests:
+                digest = self._shard_digests[shard]
+                bundles = self._load_shard(shard, digest)
+                if hashlib.sha1(index_shard_to_bytes(bundles)).hexdigest() != digest:
+                    raise Exception("Index shard '%s' does not match its digest %s" % (shard, digest))
+            else:
+                bundles = dict()
+            self._shards[shard] = bundles
+        return bundles
+
+    def _shard_for_bundle(self, bundle_name: str) -> Dict:
+        return self._get_shard(index_shard_for_bundle(bundle_name, self.prefix_length))
+
+    def _shard_names(self):
+        return sorted(set(self._shard_digests) | set(self._shards))
+
+    def __getitem__(self, bundle_name):
+        return self._shard_for_bundle(bundle_name)[bundle_name]
+
+    def __setitem__(self, bundle_name, bundle_info):
+        self._shard_for_bundle(bundle_name)[bundle_name] = bundle_info
+
+    def __delitem__(self, bundle_name):
+        del self._shard_for_bundle(bundle_name)[bundle_name]
+
+    def __iter__(self):
+        for shard in self._shard_names():
+            for bundle_name in list(self._get_shard(shard).keys()):
+                yield bundle_name
+
+    def __len__(self):
+        return sum(len(self._get_shard(shard)) for shard in self._shard_names())
+
+    @property
+    def loaded_shards(self) -> List[str]:
+        return sorted(self._shards.keys())
+
+    def copy(self):
+        """Returns a copy that shares no loaded state with this instance.
+        Shards which are not loaded yet are read by the copy on demand, by
+        their digests as of the copy, so the copy never sees changes made
+        after it was taken."""
+        other = self.__class__(self._shard_digests, self._load_shard, self.prefix_length)
+        other._shards = copy.deepcopy(self._shards)
+        return other
+
+    def changed_shards(self) -> Dict[str, bytes]:
+        """Returns the serialized shards that differ from the stored ones.
+        Only loaded shards can have changed."""
+        changed = dict()
+        for shard, bundles in self._shards.items():
+            if len(bundles) == 0:
+                continue  # empty shards are dropped from the root
+            bytes = index_shard_to_bytes(bundles)
+            if hashlib.sha1(bytes).hexdigest() != self._shard_digests.get(shard):
+                changed[shard] = bytes
+        return changed
+
+    def shard_digests(self) -> Dict[str, str]:
+        """Returns the digests of all non-empty shards as of now."""
+        digests = dict(self._shard_digests)
+        for shard, bundles in self._shards.items():
+            if len(bundles) == 0:
+                digests.pop(shard, None)
+            else:
+                digests[shard] = hashlib.sha1(index_shard_to_bytes(bundles)).hexdigest()
+        return digests
+
+    def mark_saved(self, shard_digests: Dict[str, str]) -> None:
+        self._shard_digests = dict(shard_digests)
+
+
 class ZincIndex(ZincModel):
 
-    def __init__(self, id=None, **kwargs):
+    # mutating methods which are recorded in the journal
+    JOURNAL_OPS = ('add_version_for_bundle', 'increment_next_version_for_bundle',
+                   'delete_bundle_version', 'update_distribution', 'delete_distribution',
+                   'set_object_refs_generation')
+
+    def __init__(self, id=None, layout=None, **kwargs):
         super().__init__(**kwargs)
         self._format = defaults['zinc_format']
         self._id = id
+        self._layout = layout
         self._bundle_info_by_name = dict()
+        self.journal_seq = None
+        self._object_refs_generation = None
+        self._pending_journal_ops = list()
+        self._journal_depth = 0
+        self._replaying_journal = False
 
     def to_dict(self) -> Dict:
         if self.id is None:
             raise ValueError("catalog id is None")  # TODO: better exception?
-        return {
+        d = {
             'id': self.id,
-            'bundles': self._bundle_info_by_name,
+            'bundles': dict(self._bundle_info_by_name.items()),
             'format': self._format,
         }
+        if self._layout is not None:
+            d['layout'] = self._layout
+        if self.journal_seq is not None:
+            d['journal_seq'] = self.journal_seq
+        if self._object_refs_generation is not None:
+            d['object_refs_generation'] = self._object_refs_generation
+        return d
 
     @property
     def id(self) -> str:
@@ -117,14 +287,99 @@ class ZincIndex(ZincModel):
     def format(self) -> str:
         return self._format
 
+    @property
+    def layout(self) -> Optional[str]:
+        """The layout of the stored index, `INDEX_LAYOUT_SHARDED` or `None`
+        for a single file."""
+        return self._layout
+
+    @property
+    def is_sharded(self) -> bool:
+        return isinstance(self._bundle_info_by_name, _ShardedBundleInfo)
+
     @classmethod
     def from_dict(cls, d: Dict, mutable: bool = True):
         # TODO: handle format appropriately
-        index = cls(id=d['id'], mutable=mutable)
+        index = cls(id=d['id'], layout=d.get('layout'), mutable=mutable)
         index._format = d['format']
-        index._bundle_info_by_name = d['bundles']
+        index._bundle_info_by_name = d.get('bundles', dict())
+        index.journal_seq = d.get('journal_seq')
+        index._object_refs_generation = d.get('object_refs_generation')
         return index
 
+    @classmethod
+    def from_shard_root(cls, root: Dict, load_shard, mutable: bool = True):
+        """Returns an index backed by shards. `load_shard` is called with a
+        shard name and its digest the first time a bundle in that shard is
+        accessed, and must return the `bundles` dict of the shard."""
+        index = cls(id=root['id'], layout=INDEX_LAYOUT_SHARDED, mutable=mutable)
+        index._format = root['format']
+        index._bundle_info_by_name = _ShardedBundleInfo(
+            root['shards'], load_shard, root['shard_prefix_length'])
+        index.journal_seq = root.get('journal_seq')
+        index._object_refs_generation = root.get('object_refs_generation')
+        return index
+
+    def shard(self, prefix_length: int, load_shard=None) -> None:
+        """Switches the index to the sharded layout. Does nothing if the index
+        is sharded already."""
+        if not self.is_sharded:
+            self._bundle_info_by_name = _ShardedBundleInfo.from_dict(
+                self._bundle_info_by_name, prefix_length, load_shard=load_shard)
+        self._layout = INDEX_LAYOUT_SHARDED
+
+    def to_shard_root_dict(self) -> Dict:
+        assert self.is_sharded
+        d = {
+            'id': self.id,
+            'format': self._format,
+            'shard_prefix_length': self._bundle_info_by_name.prefix_length,
+            'shards': self._bundle_info_by_name.shard_digests(),
+        }
+        if self.journal_seq is not None:
+            d['journal_seq'] = self.journal_seq
+        if self._object_refs_generation is not None:
+            d['object_refs_generation'] = self._object_refs_generation
+        return d
+
+    def changed_shards(self) -> Dict[str, bytes]:
+        assert self.is_sharded
+        return self._bundle_info_by_name.changed_shards()
+
+    def mark_shards_saved(self, root: Dict) -> None:
+        assert self.is_sharded
+        self._bundle_info_by_name.mark_saved(root['shards'])
+
+    def clone(self, mutable=True):
+        if not self.is_sharded:
+            return super().clone(mutable=mutable)
+        # avoid loading every shard
+        index = self.__class__(id=self.id, layout=self._layout, mutable=mutable)
+        index._format = self._format
+        index._bundle_info_by_name = self._bundle_info_by_name.copy()
+        index.journal_seq = self.journal_seq
+        index._object_refs_generation = self._object_refs_generation
+        return index
+
+    def pop_journal_ops(self) -> List:
+        """Returns the operations recorded since the last call, in the form
+        `[method_name, [args]]`."""
+        ops = self._pending_journal_ops
+        self._pending_journal_ops = list()
+        return ops
+
+    def apply_journal_ops(self, ops: List) -> None:
+        """Replays operations returned by `pop_journal_ops`. Replayed
+        operations are not recorded again."""
+        self._replaying_journal = True
+        try:
+            for name, args in ops:
+                if name not in self.JOURNAL_OPS:
+                    raise ValueError("Invalid journal operation '%s'" % (name))
+                getattr(self, name)(*args)
+        finally:
+            self._replaying_journal = False
+
     @classmethod
     def _load_schema(cls):
         schema_string = resource_string('zinc.resources.schemas.v1', 'catalog.json').decode('utf-8')
@@ -149,19 +404,42 @@ class ZincIndex(ZincModel):
         return info
 
     @mutable_only
-    def add_version_for_bundle(self, bundle_name, version):
+    @journaled
+    def add_version_for_bundle(self, bundle_name, version, digest=None):
         bundle_info = self._get_or_create_bundle_info(bundle_name)
         if version not in bundle_info['versions']:
             bundle_info['versions'].append(version)
             bundle_info['versions'] = sorted(bundle_info['versions'])
         else:
             raise ValueError('Bundle version %d already exists.' % (version))
+        if digest is not None:
+            bundle_info.setdefault('digests', dict())[str(version)] = digest
+
+    @property
+    def object_refs_generation(self) -> Optional[str]:
+        """Changes whenever the object reference index of the catalog is
+        rebuilt, so other writers notice it with the index."""
+        return self._object_refs_generation
 
     @mutable_only
+    @journaled
+    def set_object_refs_generation(self, generation):
+        self._object_refs_generation = generation
+
+    @mutable_only
+    @journaled
     def increment_next_version_for_bundle(self, bundle_name):
         bundle_info = self._get_or_create_bundle_info(bundle_name)
         bundle_info['next_version'] = self.next_version_for_bundle(bundle_name) + 1
 
+    def digest_for_bundle_version(self, bundle_name, version) -> Optional[str]:
+        """Returns the content digest of the manifest of a bundle version, see
+        `ZincManifest.digest`, or `None` if it was not recorded."""
+        info = self._get_bundle_info(bundle_name)
+        if info is None:
+            return None
+        return (info.get('digests') or {}).get(str(version))
+
     def versions_for_bundle(self, bundle_name):
         info = self._get_bundle_info(bundle_name)
         return info.get('versions') if info is not None else list()
@@ -180,6 +458,7 @@ class ZincIndex(ZincModel):
         return next_version
 
     @mutable_only
+    @journaled
     def delete_bundle_version(self, bundle_name, bundle_version):
         assert bundle_version == int(bundle_version)
         bundle_info = self._bundle_info_by_name.get(bundle_name)
@@ -192,6 +471,8 @@ class ZincIndex(ZincModel):
         versions = bundle_info['versions']
         if bundle_version in versions:
             versions.remove(bundle_version)
+        if 'digests' in bundle_info:
+            bundle_info['digests'].pop(str(bundle_version), None)
         if len(versions) == 0:  # remove info if no more versions
             del self._bundle_info_by_name[bundle_name]
         else:
@@ -220,6 +501,7 @@ class ZincIndex(ZincModel):
         return info.get(distro) if info else None
 
     @mutable_only
+    @journaled
     def update_distribution(self, distribution_name, bundle_name, bundle_version):
         if int(bundle_version) not in self.versions_for_bundle(bundle_name):
             raise ValueError("Invalid bundle version")
@@ -227,6 +509,7 @@ class ZincIndex(ZincModel):
         bundle_info['distributions'][distribution_name] = bundle_version
 
     @mutable_only
+    @journaled
     def delete_distribution(self, distribution_name, bundle_name):
         bundle_info = self._bundle_info_by_name.get(bundle_name)
         if bundle_name is None:
@@ -236,29 +519,143 @@ class ZincIndex(ZincModel):
 
 # ZincFileList
 
+_SHA_RE = re.compile('[0-9a-f]{40}\\Z')
+
+
+class _NameTable(object):
+    """Maps names which occur in the entries of many files, like formats and
+    flavors, to small integers."""
+
+    def __init__(self):
+        self._ids = dict()  # type: Dict[str, int]
+        self._names = list()  # type: List[str]
+        self._lock = threading.Lock()
+
+    def id_for_name(self, name: str) -> int:
+        id = self._ids.get(name)
+        if id is None:
+            with self._lock:
+                id = self._ids.get(name)
+                if id is None:
+                    id = len(self._names)
+                    self._names.append(name)
+                    self._ids[name] = id
+        return id
+
+    def name_for_id(self, id: int) -> str:
+        return self._names[id]
+
+
+_format_names = _NameTable()
+_flavor_names = _NameTable()
+
+
+class _FileRecord(object):
+    """The entry of a file in a `ZincFileList`.
+
+    `sha` is the binary digest, or the string if it is not a hex SHA1.
+    `formats` is a flat tuple of format ids and sizes, or a dict if the format
+    infos contain more than the size. `flavors` is a tuple of flavor ids.
+    Missing `formats` and `flavors` are `None`, so entries round-trip exactly.
+    """
+
+    __slots__ = ('sha', 'formats', 'flavors')
+
+    def __init__(self, sha, formats=None, flavors=None):
+        self.sha = sha
+        self.formats = formats
+        self.flavors = flavors
+
+    @classmethod
+    def from_dict(cls, d: Dict):
+        record = cls(_pack_sha(d['sha']))
+        if 'formats' in d:
+            record.set_formats(d['formats'])
+        if 'flavors' in d:
+            record.flavors = tuple(_flavor_names.id_for_name(f) for f in d['flavors'])
+        return record
+
+    def sha_string(self) -> str:
+        return self.sha.hex() if isinstance(self.sha, bytes) else self.sha
+
+    def get_formats(self) -> Optional[Dict]:
+        if self.formats is None or isinstance(self.formats, dict):
+            return self.formats
+        formats = self.formats
+        return dict((_format_names.name_for_id(formats[i]), {'size': formats[i + 1]})
+                    for i in range(0, len(formats), 2))
+
+    def set_formats(self, formats: Dict) -> None:
+        packed = list()
+        for format, format_info in formats.items():
+            if list(format_info.keys()) != ['size']:
+                self.formats = copy.deepcopy(formats)
+                return
+            packed.append(_format_names.id_for_name(format))
+            packed.append(format_info['size'])
+        self.formats = tuple(packed)
+
+    def get_flavors(self) -> Optional[List[str]]:
+        if self.flavors is None:
+            return None
+        return [_flavor_names.name_for_id(f) for f in self.flavors]
+
+    def to_dict(self) -> Dict:
+        d = {'sha': self.sha_string()}
+        if self.formats is not None:
+            d['formats'] = self.get_formats()
+        if self.flavors is not None:
+            d['flavors'] = self.get_flavors()
+        return d
+
+
+def _pack_sha(sha):
+    if isinstance(sha, str) and _SHA_RE.match(sha):
+        return bytes.fromhex(sha)
+    return sha
+
+
 class ZincFileList(ZincModel, MutableMapping):
+    """Maps file paths to their entries, `{'sha': ..., 'formats': {format:
+    {'size': ...}}, 'flavors': [...]}`. Manifests can list a great many
+    files, so the entries are stored compactly as `_FileRecord`s, with
+    interned paths, and are only expanded to dicts when accessed."""
 
     def __init__(self, **kwargs):
         ZincModel.__init__(self, **kwargs)
         MutableMapping.__init__(self)
-        self._files = dict()
+        self._files = dict()  # type: Dict[str, _FileRecord]
+        # flavor id -> paths, built on demand by `get_all_files`
+        self._paths_by_flavor = None  # type: Optional[Dict[int, List[str]]]
+        # generation and digest, see `content_digest`
+        self._content_digest = None
 
     @classmethod
     def from_dict(cls, d, mutable=True):
         obj = cls(mutable=mutable)
-        obj._files = d
+        obj._files = dict((sys.intern(path), _FileRecord.from_dict(props))
+                          for path, props in d.items())
         return obj
 
+    def _build_paths_by_flavor(self):
+        paths_by_flavor = dict()  # type: Dict[int, List[str]]
+        for path, record in self._files.items():
+            for flavor_id in record.flavors or ():
+                paths_by_flavor.setdefault(flavor_id, list()).append(path)
+        return paths_by_flavor
+
     def __getitem__(self, key):
-        return self._files[key]
+        return self._files[key].to_dict()
 
     @mutable_only
     def __setitem__(self, key, item):
-        self._files[key] = item
+        self._files[sys.intern(key)] = _FileRecord.from_dict(item)
+        self._paths_by_flavor = None
 
     @mutable_only
     def __delitem__(self, key):
         del self._files[key]
+        self._paths_by_flavor = None
 
     def __len__(self):
         return len(self._files)
@@ -266,48 +663,54 @@ class ZincFileList(ZincModel, MutableMapping):
     def __iter__(self):
         return iter(self._files)
 
+    def __contains__(self, key):
+        return key in self._files
+
     def keys(self):
         return self._files.keys()
 
     def to_dict(self):
-        return self._files
+        return dict((path, record.to_dict()) for path, record in self._files.items())
 
     @mutable_only
     def add_file(self, path, sha):
-        self._files[path] = {'sha': sha}
+        self._files[sys.intern(path)] = _FileRecord(_pack_sha(sha))
+        self._paths_by_flavor = None
 
     def sha_for_file(self, path):
-        return self._files.get(path).get('sha') if self._files.get(path) else None
+        record = self._files.get(path)
+        return record.sha_string() if record is not None else None
 
     @mutable_only
     def add_flavor_for_file(self, path, flavor):
-        props = self._files[path]
-        flavors = props.get('flavors') or []
-        if flavor not in flavors:
-            flavors.append(flavor)
-        props['flavors'] = flavors
+        record = self._files[path]
+        flavors = record.flavors or ()
+        flavor_id = _flavor_names.id_for_name(flavor)
+        if flavor_id not in flavors:
+            flavors = flavors + (flavor_id,)
+            self._paths_by_flavor = None
+        record.flavors = flavors
 
     def flavors_for_file(self, path):
-        return self._files[path].get('flavors')
+        return self._files[path].get_flavors()
 
     @mutable_only
     def add_format_for_file(self, path, format, size):
-        props = self._files[path]
-        formats = props.get('formats') or {}
+        record = self._files[path]
+        formats = record.get_formats() or {}
         formats[format] = {'size': size}
-        props['formats'] = formats
+        record.set_formats(formats)
 
     def formats_for_file(self, path):
-        props = self._files[path]
-        formats = props.get('formats')
-        return formats
+        return self._files[path].get_formats()
 
     def get_format_info_for_file(self, path, preferred_formats=None):
 
         if preferred_formats is None:
             preferred_formats = defaults['catalog_preferred_formats']
+        formats = self.formats_for_file(path)
         for format in preferred_formats:
-            format_info = self.formats_for_file(path).get(format)
+            format_info = formats.get(format)
             if format_info is not None:
                 return (format, format_info)
 
@@ -319,7 +722,29 @@ class ZincFileList(ZincModel, MutableMapping):
         if flavor is None:
             return all_files
         else:
-            return [f for f in all_files if flavor in self.flavors_for_file(f)]
+            paths_by_flavor = self._paths_by_flavor
+            if paths_by_flavor is None:
+                paths_by_flavor = self._build_paths_by_flavor()
+                self._paths_by_flavor = paths_by_flavor
+            return list(paths_by_flavor.get(_flavor_names.id_for_name(flavor), ()))
+
+    def content_digest(self) -> str:
+        """
+        Returns a SHA1 digest over the sorted paths of all files with their
+        sha and (sorted) flavors. File lists with equivalent contents, see
+        `contents_are_equalivalent`, have the same digest.
+        """
+        if self._content_digest is not None and self._content_digest[0] == self._generation:
+            return self._content_digest[1]
+        h = hashlib.sha1()
+        for path in sorted(self._files.keys()):
+            record = self._files[path]
+            h.update(json.dumps([path, record.sha_string(), sorted(record.get_flavors() or [])])
+                     .encode('utf8'))
+            h.update(b'\n')
+        digest = h.hexdigest()
+        self._content_digest = (self._generation, digest)
+        return digest
 
     def contents_are_equalivalent(self, other_filelist):
         """
@@ -330,6 +755,9 @@ class ZincFileList(ZincModel, MutableMapping):
         if len(self) != len(other_filelist):
             return False
 
+        if isinstance(other_filelist, ZincFileList):
+            return self.content_digest() == other_filelist.content_digest()
+
         for path in other_filelist.keys():
             my_sha = self.sha_for_file(path)
             if my_sha is None:
@@ -347,6 +775,57 @@ class ZincFileList(ZincModel, MutableMapping):
         return True
 
 
+# Diffs
+
+ZincFileDiff = namedtuple('ZincFileDiff', 'path change from_sha to_sha size_delta')
+
+FILE_ADDED = 'added'
+FILE_REMOVED = 'removed'
+FILE_MODIFIED = 'modified'
+
+
+def _size_for_file(filelist, path, preferred_formats):
+    format, format_info = filelist.get_format_info_for_file(path, preferred_formats=preferred_formats)
+    return format_info['size'] if format_info is not None else 0
+
+
+def diff_file_lists(from_files, to_files, flavor=None, preferred_formats=None):
+    """
+    Yields a `ZincFileDiff` for every path that was added, removed or whose
+    sha changed between two file lists, in path order. Only the files of
+    `flavor` are compared if it is given. The size delta is based on the size
+    of the first of `preferred_formats` a file is available in.
+    """
+    if preferred_formats is None:
+        preferred_formats = defaults['catalog_preferred_formats']
+
+    from_paths = sorted(from_files.get_all_files(flavor=flavor))
+    to_paths = sorted(to_files.get_all_files(flavor=flavor))
+
+    i, j = 0, 0
+    while i < len(from_paths) or j < len(to_paths):
+        from_path = from_paths[i] if i < len(from_paths) else None
+        to_path = to_paths[j] if j < len(to_paths) else None
+
+        if to_path is None or (from_path is not None and from_path < to_path):
+            yield ZincFileDiff(from_path, FILE_REMOVED, from_files.sha_for_file(from_path), None,
+                               -_size_for_file(from_files, from_path, preferred_formats))
+            i += 1
+        elif from_path is None or to_path < from_path:
+            yield ZincFileDiff(to_path, FILE_ADDED, None, to_files.sha_for_file(to_path),
+                               _size_for_file(to_files, to_path, preferred_formats))
+            j += 1
+        else:
+            from_sha = from_files.sha_for_file(from_path)
+            to_sha = to_files.sha_for_file(to_path)
+            if from_sha != to_sha:
+                yield ZincFileDiff(to_path, FILE_MODIFIED, from_sha, to_sha,
+                                   _size_for_file(to_files, to_path, preferred_formats) -
+                                   _size_for_file(from_files, from_path, preferred_formats))
+            i += 1
+            j += 1
+
+
 # ZincManifest
 
 class ZincManifest(ZincModel):
@@ -374,7 +853,7 @@ class ZincManifest(ZincModel):
         manifest = ZincManifest(catalog_id, bundle_name,
                                 version, mutable=mutable)
         manifest._format = d.get('format') or defaults['zinc_format']
-        manifest._files = ZincFileList.from_dict(d['files'])
+        manifest._files = ZincFileList.from_dict(d['files'], mutable=mutable)
         manifest._flavors = d.get('flavors') or []  # to support legacy
         return manifest
 
@@ -394,6 +873,13 @@ class ZincManifest(ZincModel):
     def bundle_name(self) -> str:
         return self._bundle_name
 
+    @property
+    def digest(self) -> str:
+        """The content digest of the files, see `ZincFileList.content_digest`.
+        It is not part of the manifest format; the catalog records it in the
+        index, so bundle versions can be compared without loading them."""
+        return self._files.content_digest()
+
     @property
     def files(self):
         return self._files
@@ -424,6 +910,10 @@ class ZincManifest(ZincModel):
     def sha_for_file(self, path):
         return self._files.sha_for_file(path)
 
+    def shas(self):
+        """Returns the set of SHAs of all files."""
+        return set(self._files.sha_for_file(path) for path in self._files.keys())
+
     @mutable_only
     def add_flavor_for_file(self, path, flavor):
         self._files.add_flavor_for_file(path, flavor)
@@ -474,6 +964,8 @@ class ZincFlavorSpec(ZincModel):
         super().__init__(**kwargs)
         self._filters_by_name = dict()
         self._created_unified_bundle = True
+        # all filters compiled together, built on demand by `flavors_for_path`
+        self._filter_group = None
 
     @property
     def flavors(self):
@@ -485,6 +977,18 @@ class ZincFlavorSpec(ZincModel):
     @mutable_only
     def add_flavor(self, flavor_name, path_filter):
         self._filters_by_name[flavor_name] = path_filter
+        self._filter_group = None
+
+    def flavors_for_path(self, path):
+        """Returns a list of all flavors whose filter matches `path`. The
+        filters of all flavors are evaluated with a single regex match."""
+        flavors = list(self._filters_by_name.keys())
+        filter_group = self._filter_group
+        if filter_group is None:
+            filter_group = PathFilterGroup([self._filters_by_name[f] for f in flavors])
+            self._filter_group = filter_group
+        return [flavor for flavor, matched in zip(flavors, filter_group.match(path))
+                if matched]
 
     @classmethod
     def from_dict(cls, d, mutable=True):
@@ -1,4 +1,6 @@
 import fnmatch
+import os
+import re
 from typing import List
 
 
@@ -8,6 +10,12 @@ class Match:
     UNKNOWN = 3
 
 
+def _compile_pattern(pattern: str) -> str:
+    """Returns the regex source for a shell-style pattern, matching the
+    semantics of `fnmatch.fnmatch`."""
+    return fnmatch.translate(os.path.normcase(pattern))
+
+
 class PathFilter(object):
 
     class Rule(object):
@@ -15,24 +23,51 @@ class PathFilter(object):
             assert match_action in (Match.ACCEPT, Match.REJECT)
             self.pattern = pattern
             self.match_action = match_action
+            self._regex = re.compile(_compile_pattern(pattern))
 
         def match(self, path: str):
-            if fnmatch.fnmatch(path, self.pattern):
+            if self._regex.match(os.path.normcase(path)):
                 return self.match_action
             return Match.UNKNOWN
 
     def __init__(self, rules: List[Rule]):
         self._rules = rules
+        self._compile()
+
+    def _compile(self):
+        """Compiles all rules into a single regex with one group per rule.
+        Alternatives are tried in order, so the first rule group that took
+        part in the match is the first matching rule."""
+
+        self._regex = None
+        self._group_actions = list()
+        if len(self._rules) == 0:
+            return
+
+        alternatives = list()
+        group = 1
+        for rule in self._rules:
+            alternatives.append('(%s)' % (_compile_pattern(rule.pattern)))
+            self._group_actions.append((group, rule.match_action))
+            group += 1 + rule._regex.groups
+        self._regex = re.compile('|'.join(alternatives))
 
     def match(self, path: str):
         """Tests the path against all rules in this filter"""
-        for rule in self._rules:
-            if rule.match(path) == Match.ACCEPT:
-                return True
-            elif rule.match(path) == Match.REJECT:
-                return False
+        if self._regex is None:
+            return True
+        m = self._regex.match(os.path.normcase(path))
+        if m is None:
+            return True
+        for group, match_action in self._group_actions:
+            if m.group(group) is not None:
+                return match_action == Match.ACCEPT
         return True
 
+    @property
+    def rules(self) -> List[Rule]:
+        return self._rules
+
     @staticmethod
     def from_rule_list(rule_list):
         """Read from a dict. `version` is ignored"""
@@ -51,3 +86,44 @@ class PathFilter(object):
             pattern = ' '.join(rule_comps[1:])
             rules.append(PathFilter.Rule(pattern, match_action))
         return PathFilter(rules)
+
+
+class PathFilterGroup(object):
+    """Evaluates several `PathFilter`s with a single regex match. Each filter
+    is compiled into a lookahead which always succeeds, so the match runs
+    through all of them, and the rule groups that took part in the match tell
+    which rule of each filter matched first."""
+
+    def __init__(self, filters: List[PathFilter]):
+        self._filters = filters
+        self._compile()
+
+    def _compile(self):
+        lookaheads = list()
+        self._group_actions = list()  # per filter
+        group = 1
+        for path_filter in self._filters:
+            alternatives = list()
+            group_actions = list()
+            for rule in path_filter.rules:
+                source = _compile_pattern(rule.pattern)
+                alternatives.append('(%s)' % (source))
+                group_actions.append((group, rule.match_action))
+                group += 1 + re.compile(source).groups
+            if len(alternatives) > 0:
+                lookaheads.append('(?=(?:%s)?)' % ('|'.join(alternatives)))
+            self._group_actions.append(group_actions)
+        self._regex = re.compile(''.join(lookaheads))
+
+    def match(self, path: str) -> List[bool]:
+        """Returns the result of `PathFilter.match` for every filter."""
+        m = self._regex.match(os.path.normcase(path))
+        results = list()
+        for group_actions in self._group_actions:
+            result = True
+            for group, match_action in group_actions:
+                if m.group(group) is not None:
+                    result = match_action == Match.ACCEPT
+                    break
+            results.append(result)
+        return results
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+zinc.refs
+~~~~~~~~~
+
+This module implements the object reference index of a catalog, which maps
+the SHA of every object to the bundle versions whose manifests reference it.
+It is split into shards by SHA prefix, which are loaded on demand, so objects
+can be checked for references without reading any manifests.
+
+"""
+
+import json
+from typing import Dict, Iterable, List, Set
+
+OBJECT_REFS_FORMAT = 1
+OBJECT_REFS_SHARD_PREFIX_LENGTH = 2
+
+
+def object_refs_shard_for_sha(sha: str) -> str:
+    return sha[:OBJECT_REFS_SHARD_PREFIX_LENGTH]
+
+
+class ObjectRefs(object):
+
+    def __init__(self, load_shard=None):
+        # `load_shard` returns the refs of a shard, or `None` if it is empty
+        self._load_shard = load_shard
+        self._shards = dict()  # type: Dict[str, Dict[str, List]]
+        self._dirty = set()  # type: Set[str]
+        self._pending_removals = list()
+
+    def _get_shard(self, shard: str) -> Dict[str, List]:
+        refs = self._shards.get(shard)
+        if refs is None:
+            if self._load_shard is not None:
+                refs = self._load_shard(shard)
+            if refs is None:
+                refs = dict()
+            self._shards[shard] = refs
+        return refs
+
+    def add_refs(self, bundle_name: str, version: int, shas: Iterable[str]) -> None:
+        ref = [bundle_name, int(version)]
+        for sha in shas:
+            shard = object_refs_shard_for_sha(sha)
+            refs = self._get_shard(shard).setdefault(sha, list())
+            if ref not in refs:
+                refs.append(ref)
+                refs.sort()
+                self._dirty.add(shard)
+
+    def remove_refs(self, bundle_name: str, version: int, shas: Iterable[str]) -> None:
+        """Queues the removal of references. Removals only take effect once
+        `apply_removals` is called, so they can be saved separately."""
+        self._pending_removals.append(([bundle_name, int(version)], list(shas)))
+
+    def apply_removals(self) -> None:
+        for ref, shas in self._pending_removals:
+            for sha in shas:
+                shard = object_refs_shard_for_sha(sha)
+                refs_by_sha = self._get_shard(shard)
+                refs = refs_by_sha.get(sha)
+                if refs is None or ref not in refs:
+                    continue
+                refs.remove(ref)
+                if len(refs) == 0:
+                    del refs_by_sha[sha]
+                self._dirty.add(shard)
+        self._pending_removals = list()
+
+    def refs_for_sha(self, sha: str) -> List:
+        """Returns the `[bundle_name, version]` pairs referencing `sha`."""
+        return list(self._get_shard(object_refs_shard_for_sha(sha)).get(sha, []))
+
+    def refcount(self, sha: str) -> int:
+        return len(self._get_shard(object_refs_shard_for_sha(sha)).get(sha, []))
+
+    def referenced_shas(self, shards: Iterable[str]) -> Set[str]:
+        """Returns the SHAs of all referenced objects in `shards`."""
+        shas = set()
+        for shard in shards:
+            shas.update(self._get_shard(shard).keys())
+        return shas
+
+    @staticmethod
+    def shard_to_bytes(refs: Dict[str, List]) -> bytes:
+        return json.dumps({
+            'format': OBJECT_REFS_FORMAT,
+            'refs': refs,
+        }, sort_keys=True).encode('utf8')
+
+    @staticmethod
+    def shard_from_bytes(b: bytes) -> Dict[str, List]:
+        return json.loads(b.decode('utf8'))['refs']
+
+    def pop_changed_shards(self) -> Dict[str, bytes]:
+        """Returns the serialized shards changed since the last call."""
+        changed = dict()
+        for shard in sorted(self._dirty):
+            changed[shard] = self.shard_to_bytes(self._shards[shard])
+        self._dirty = set()
+        return changed
@@ -1,4 +1,8 @@
+from contextlib import contextmanager
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+import zinc.utils as utils
 
 
 class StorageBackend(object):
@@ -24,9 +28,20 @@ class StorageBackend(object):
         raise NotImplementedError()
 
     def puts(self, subpath: str, bytes: bytearray, **kwargs):
-        """Write string 'bytes' to subpath."""
+        """Write string 'bytes' to subpath, see `put`."""
         fileobj = BytesIO(bytes)
-        self.put(subpath, fileobj, **kwargs)
+        return self.put(subpath, fileobj, **kwargs)
+
+    @contextmanager
+    def open_for_write(self, subpath: str, **kwargs):
+        """Context manager providing a writable file-like object. The data is
+        stored at subpath only if the context exits without an exception.
+        Backends should override this to stream the data instead of spooling
+        it to a temporary file."""
+        with SpooledTemporaryFile(max_size=utils.CHUNK_SIZE) as fileobj:
+            yield fileobj
+            fileobj.seek(0)
+            self.put(subpath, fileobj, **kwargs)
 
     # Methods to override
 
@@ -41,21 +56,34 @@ class StorageBackend(object):
 
         Keys:
            - size: the size of the file
+           - version_token: an opaque string that changes whenever the item
+             is rewritten, or None if the backend can not provide one
+           - mtime: the time the item was last written, in seconds since the
+             epoch, or None if the backend can not provide one
         """
         raise NotImplementedError()
 
     def put(self, subpath, fileobj, **kwargs):
-        """Write data from file-like object 'fileobj' to subpath."""
+        """Write data from file-like object 'fileobj' to subpath. Returns the
+        version token of the written item, see `get_meta`, or None if the
+        backend can not provide one."""
         raise NotImplementedError()
 
-    def list(self, prefix=None):
-        """List contents, with optional prefix."""
+    def list(self, prefix=None, marker=None):
+        """List contents in sorted order, with optional prefix. If `marker`
+        is given, only contents sorting after it are listed."""
         raise NotImplementedError()
 
     def delete(self, subpath):
         """Delete subpath."""
         raise NotImplementedError()
 
+    def delete_many(self, subpaths):
+        """Delete all subpaths. Backends should override this if they can
+        delete in batches."""
+        for subpath in subpaths:
+            self.delete(subpath)
+
 
 def storage_for_url(url):
     from .filesystem import FilesystemStorageBackend
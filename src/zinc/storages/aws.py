@@ -1,4 +1,7 @@
 import os
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from io import BytesIO
 from tempfile import TemporaryFile
 from copy import copy
 from urllib.parse import urlparse
@@ -14,6 +17,38 @@ from zinc.defaults import defaults
 log = logging.getLogger(__name__)
 
 
+class _S3MultipartWriter(object):
+    """Writable file-like object that uploads its data as the parts of an S3
+    multipart upload, holding at most one part in memory."""
+
+    def __init__(self, multipart_upload, part_size):
+        self._mp = multipart_upload
+        self._part_size = part_size
+        self._part_num = 0
+        self._buffer = BytesIO()
+
+    def write(self, b):
+        self._buffer.write(b)
+        if self._buffer.tell() >= self._part_size:
+            self._upload_part()
+        return len(b)
+
+    def _upload_part(self):
+        self._part_num += 1
+        self._buffer.seek(0)
+        self._mp.upload_part_from_file(self._buffer, self._part_num)
+        self._buffer = BytesIO()
+
+    def complete(self):
+        # the last part may be smaller than the minimum part size
+        if self._buffer.tell() > 0 or self._part_num == 0:
+            self._upload_part()
+        self._mp.complete_upload()
+
+    def cancel(self):
+        self._mp.cancel_upload()
+
+
 class S3StorageBackend(StorageBackend):
 
     def __init__(self, url=None, aws_key=None, aws_secret=None,
@@ -70,6 +105,9 @@ class S3StorageBackend(StorageBackend):
             return None
         meta = dict()
         meta['size'] = key.size
+        meta['version_token'] = key.etag
+        meta['mtime'] = parsedate_to_datetime(key.last_modified).timestamp() \
+            if key.last_modified else None
         return meta
 
     def put(self, subpath, fileobj, max_age=None, **kwargs):
@@ -78,11 +116,29 @@ class S3StorageBackend(StorageBackend):
         if max_age is not None:
             k.set_metadata('Cache-Control', 'max-age=%d' % (max_age))
         k.set_contents_from_file(fileobj)
+        return k.etag
 
-    def list(self, prefix=None):
+    @contextmanager
+    def open_for_write(self, subpath, max_age=None, **kwargs):
+        headers = dict()
+        if max_age is not None:
+            headers['Cache-Control'] = 'max-age=%d' % (max_age)
+        mp = self._bucket.initiate_multipart_upload(self._get_keyname(subpath),
+                                                    headers=headers)
+        writer = _S3MultipartWriter(mp, defaults['storage_aws_multipart_part_size'])
+        try:
+            yield writer
+            writer.complete()
+        except BaseException:
+            writer.cancel()
+            raise
+
+    def list(self, prefix=None, marker=None):
         contents = []
         subpath = self._get_keyname(prefix)
-        for k in self._bucket.list(prefix=subpath):
+        if marker is not None:
+            marker = '%s/%s' % (subpath, marker)
+        for k in self._bucket.list(prefix=subpath, marker=marker or ''):
             if k.name.endswith("/"):
                 # skip "directory" keys
                 continue
@@ -92,3 +148,11 @@ class S3StorageBackend(StorageBackend):
 
     def delete(self, subpath):
         self._bucket.delete_key(self._get_keyname(subpath))
+
+    def delete_many(self, subpaths):
+        # boto sends at most 1000 keys per request, the S3 limit
+        result = self._bucket.delete_keys([self._get_keyname(p) for p in subpaths],
+                                          quiet=True)
+        if len(result.errors) > 0:
+            raise Exception("Failed to delete %d keys, first error: %s"
+                            % (len(result.errors), result.errors[0].message))
@@ -1,4 +1,6 @@
 import os
+import shutil
+from contextlib import contextmanager
 from urllib.parse import urlparse
 from atomicwrites import atomic_write
 from copy import copy
@@ -7,6 +9,11 @@ import zinc.utils as utils
 from . import StorageBackend
 
 
+def _version_token_for_stat(st):
+    # files are replaced atomically, so a rewrite also changes the inode
+    return '%d-%d-%d' % (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
 class FilesystemStorageBackend(StorageBackend):
 
     def __init__(self, url=None, **kwargs):
@@ -43,10 +50,14 @@ class FilesystemStorageBackend(StorageBackend):
 
     def get_meta(self, subpath):
         abs_path = self._abs_path(subpath)
-        if not os.path.exists(abs_path):
+        try:
+            st = os.stat(abs_path)
+        except FileNotFoundError:
             return None
         meta = dict()
-        meta['size'] = os.path.getsize(abs_path)
+        meta['size'] = st.st_size
+        meta['version_token'] = _version_token_for_stat(st)
+        meta['mtime'] = st.st_mtime
         return meta
 
     def put(self, subpath, fileobj, **kwargs):
@@ -55,9 +66,17 @@ class FilesystemStorageBackend(StorageBackend):
 
         # TODO: is overwrite correct behavior here?
         with atomic_write(abs_path, mode='wb', overwrite=True) as f:
-            f.write(fileobj.read())
+            shutil.copyfileobj(fileobj, f, utils.CHUNK_SIZE)
+        return _version_token_for_stat(os.stat(abs_path))
+
+    @contextmanager
+    def open_for_write(self, subpath, **kwargs):
+        abs_path = self._abs_path(subpath)
+        utils.makedirs(os.path.dirname(abs_path))
+        with atomic_write(abs_path, mode='wb', overwrite=True) as f:
+            yield f
 
-    def list(self, prefix=None):
+    def list(self, prefix=None, marker=None):
         if prefix is not None:
             dir = self._abs_path(prefix)
         else:
@@ -68,9 +87,10 @@ class FilesystemStorageBackend(StorageBackend):
             for fn in files:
                 abs_path = os.path.join(path, fn)
                 rel_path = abs_path[len(dir) + 1:]  # get path relative to dir
-                contents.append(rel_path)
+                if marker is None or rel_path > marker:
+                    contents.append(rel_path)
 
-        return contents
+        return sorted(contents)
 
     def delete(self, subpath):
         path = self._abs_path(subpath)
@@ -1,15 +1,123 @@
 import os
 import logging
+import shutil
 import tempfile
+import threading
+from collections import namedtuple, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
+import zinc.helpers as helpers
 import zinc.utils as utils
+from zinc.defaults import defaults
+from zinc.formats import Formats
+from zinc.ignore import ZincIgnore
 from zinc.models import ZincFileList, ZincManifest
-from zinc.archives import build_archive_with_manifest
+from zinc.archives import build_archive_with_manifest, build_archives_with_manifest
 
 log = logging.getLogger(__name__)
 
-# TODO: real ignore system
-IGNORE = ['.DS_Store']
+# `cached_info` and `st` are only set if a hash cache is in use
+_PlannedFile = namedtuple('_PlannedFile', 'full_path rel_path sha cached_info st')
+
+
+class _ScratchObject(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        self.size = 0
+        self.pins = 0
+
+
+class _ScratchObjects(object):
+    """Gzipped copies of source files, shared by the archives of a bundle
+    update. `uses_by_sha` counts the archives which contain each object: a
+    copy is removed once all of them were written. Least recently used copies
+    which are not being read are also removed while the total size exceeds
+    `max_bytes`, and compressed again if they are needed later. Copies made
+    while importing the objects are handed over with `add`."""
+
+    def __init__(self, dir, uses_by_sha, max_bytes):
+        self._dir = dir
+        self._uses_by_sha = Counter(uses_by_sha)
+        self._max_bytes = max_bytes
+        self._objects = OrderedDict()  # sha -> _ScratchObject
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    def path_for_sha(self, sha):
+        return os.path.join(self._dir, helpers.append_file_extension_for_format(sha, Formats.GZ))
+
+    def add(self, sha, path):
+        """Takes over a gzipped copy which was already written to
+        `path_for_sha(sha)`, e.g. while importing it."""
+        with self._lock:
+            if sha in self._objects:
+                return
+            obj = self._objects[sha] = _ScratchObject()
+            obj.path = path
+            obj.size = os.path.getsize(path)
+            self._size += obj.size
+            self._evict()
+
+    def set_uses(self, uses_by_sha):
+        """Replaces the use counts. Copies without uses are removed."""
+        with self._lock:
+            self._uses_by_sha = Counter(uses_by_sha)
+            for sha in list(self._objects.keys()):
+                if self._uses_by_sha[sha] <= 0 and self._objects[sha].pins == 0:
+                    self._remove(sha)
+
+    def acquire(self, sha, src_path):
+        """Returns the path of the gzipped copy of `src_path`. It is kept until
+        `release` is called."""
+        with self._lock:
+            obj = self._objects.get(sha)
+            if obj is None:
+                obj = self._objects[sha] = _ScratchObject()
+            obj.pins += 1
+            self._objects.move_to_end(sha)
+
+        with obj.lock:
+            if obj.path is None:
+                path = self.path_for_sha(sha)
+                with open(path, 'wb') as f:
+                    actual_sha = utils.sha1_and_gzip_path(src_path, f)
+                if actual_sha != sha:
+                    os.remove(path)
+                    raise Exception("File changed during bundle update: %s" % (src_path))
+                obj.size = os.path.getsize(path)
+                obj.path = path
+                with self._lock:
+                    self._size += obj.size
+        return obj.path
+
+    def release(self, sha):
+        with self._lock:
+            obj = self._objects[sha]
+            obj.pins -= 1
+            self._uses_by_sha[sha] -= 1
+            if self._uses_by_sha[sha] <= 0 and obj.pins == 0:
+                self._remove(sha)
+            self._evict()
+
+    def _remove(self, sha):
+        obj = self._objects.pop(sha)
+        if obj.path is not None:
+            os.remove(obj.path)
+            self._size -= obj.size
+
+    def _evict(self):
+        for sha in list(self._objects.keys()):
+            if self._size <= self._max_bytes:
+                break
+            if self._objects[sha].pins == 0:
+                self._remove(sha)
 
 
 class ZincBundleUpdateTask(object):
@@ -20,15 +128,23 @@ class ZincBundleUpdateTask(object):
                  src_dir=None,
                  flavor_spec=None,
                  force=False,
-                 skip_master_archive=True):
+                 skip_master_archive=True,
+                 jobs=None,
+                 archive_jobs=None,
+                 hash_cache=None):
 
         self.catalog = catalog
         self.bundle_name = bundle_name
         self.flavor_spec = flavor_spec
         self.force = force
         self.skip_master_archive = skip_master_archive
+        self.jobs = jobs or defaults['bundle_update_jobs']
+        self.archive_jobs = archive_jobs or defaults['bundle_update_archive_jobs']
+        self.hash_cache = hash_cache
 
         self._src_dir = src_dir
+        self._scratch_dir = None
+        self._gz_objects = None
 
     @property
     def src_dir(self):
@@ -40,43 +156,198 @@ class ZincBundleUpdateTask(object):
             val = utils.canonical_path(val)
         self._src_dir = val
 
+    @property
+    def _objects_dir(self):
+        return os.path.join(self._scratch_dir, 'objects')
+
+    @staticmethod
+    def _gz_sizes_by_sha(manifest, path_lists):
+        """Counts the uses of each GZ object in `path_lists`, one list of
+        paths per archive. Returns the counts and the sizes of the objects."""
+
+        uses_by_sha = Counter()
+        sizes_by_sha = dict()
+        for paths in path_lists:
+            for path in paths:
+                format, format_info = manifest.get_format_info_for_file(path)
+                if format == Formats.GZ:
+                    sha = manifest.sha_for_file(path)
+                    uses_by_sha[sha] += 1
+                    sizes_by_sha[sha] = format_info['size']
+        return uses_by_sha, sizes_by_sha
+
+    def _build_and_write_archive(self, manifest, flavor=None):
+        # the archive is streamed to storage, only its compressed members
+        # touch scratch disk
+        with self.catalog._open_archive_for_write(manifest.bundle_name, manifest.version,
+                                                  flavor=flavor) as fileobj:
+            build_archive_with_manifest(manifest, self.src_dir, flavor=flavor,
+                                        gz_objects=self._gz_objects,
+                                        dst_fileobj=fileobj)
+
+    def _build_and_write_archives(self, manifest, flavors):
+        with ExitStack() as stack:
+            dst_fileobjs = dict((flavor, stack.enter_context(
+                self.catalog._open_archive_for_write(manifest.bundle_name, manifest.version,
+                                                     flavor=flavor)))
+                                for flavor in flavors)
+            build_archives_with_manifest(manifest, self.src_dir, dst_fileobjs,
+                                         gz_objects=self._gz_objects)
+
+    def _write_archives(self, manifest, flavors):
+        """Writes the archives of `flavors`. If the compressed members fit into
+        the scratch space, the archives are built concurrently and share the
+        compressed copies. Otherwise they are built in a single pass over the
+        files, so each member is still compressed only once."""
+
+        path_lists = [manifest.get_all_files(flavor=flavor) for flavor in flavors]
+        uses_by_sha, sizes_by_sha = self._gz_sizes_by_sha(manifest, path_lists)
+        if sum(sizes_by_sha.values()) <= defaults['bundle_update_scratch_max_bytes']:
+            self._gz_objects.set_uses(uses_by_sha)
+            with ThreadPoolExecutor(max_workers=self.archive_jobs) as executor:
+                list(executor.map(lambda flavor: self._build_and_write_archive(manifest, flavor=flavor),
+                                  flavors))
+        else:
+            archived_paths = set()
+            for paths in path_lists:
+                archived_paths.update(paths)
+            uses_by_sha, _ = self._gz_sizes_by_sha(manifest, [archived_paths])
+            self._gz_objects.set_uses(uses_by_sha)
+            self._build_and_write_archives(manifest, flavors)
+
     @staticmethod
-    def _build_archive(catalog, manifest, src_dir, flavor=None):
+    def _walk_files(src_dir):
+        """Returns a list of `(full_path, rel_path)` tuples for all files in
+        `src_dir` that are not ignored, sorted by `rel_path`."""
 
-        archive_filename = catalog.path_helper.archive_name(manifest.bundle_name,
-                                                            manifest.version,
-                                                            flavor=flavor)
-        archive_path = os.path.join(tempfile.mkdtemp(), archive_filename)
-        build_archive_with_manifest(manifest, src_dir, archive_path, flavor=flavor)
-        return archive_path
+        ignore = ZincIgnore.from_dir(src_dir)
+        return sorted(ignore.walk(src_dir), key=lambda p: p[1])
 
-    def _import_files(self, src_dir, flavor_spec=None):
+    def _hash_file(self, full_path):
+        """Hashes a file locally, without touching the catalog. Returns a
+        `_PlannedFile` without path information."""
+
+        if self.hash_cache is None:
+            return _PlannedFile(None, None, utils.sha1_for_path(full_path), None, None)
+
+        # stat before reading, so a file modified while it is being hashed is
+        # not cached under its new stat info
+        st = os.stat(full_path)
+        cached_info = self.hash_cache.get(full_path, st)
+        if cached_info is not None:
+            return _PlannedFile(None, None, cached_info['sha'], cached_info, st)
+        return _PlannedFile(None, None, utils.sha1_for_path(full_path), None, st)
+
+    def _plan_files(self, src_dir, flavor_spec=None):
+        """Computes the candidate file list for `src_dir` locally. The file
+        list contains shas and flavors, but no formats. Returns a tuple of the
+        file list and a list of `_PlannedFile`s."""
 
         filelist = ZincFileList()
+        planned_files = list()
+
+        paths = self._walk_files(src_dir)
+        full_paths = [full_path for (full_path, rel_path) in paths]
+
+        # Hashing is done in a pool. Results are consumed in path order, so the
+        # file list does not depend on the order in which the hashes complete.
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            hashed_files = executor.map(self._hash_file, full_paths)
+
+            for (full_path, rel_path), hashed_file in zip(paths, hashed_files):
+                planned_file = hashed_file._replace(full_path=full_path, rel_path=rel_path)
+                planned_files.append(planned_file)
+                filelist.add_file(rel_path, planned_file.sha)
+
+                if flavor_spec is not None:
+                    for flavor in flavor_spec.flavors_for_path(full_path):
+                        filelist.add_flavor_for_file(rel_path, flavor)
+
+        return filelist, planned_files
+
+    def _import_file(self, planned_file):
+
+        sha = planned_file.sha
+        cached_info = planned_file.cached_info
+        if cached_info is not None:
+            file_info = self.catalog._get_file_info(
+                sha, preferred_formats=[cached_info['format']])
+            if file_info is not None:
+                return file_info
+
+        file_info = self.catalog._get_file_info(sha)
+        if file_info is not None:
+            return file_info
+
+        # The gzipped copy is kept for the archives, so the file does not
+        # have to be compressed again for them.
+        gz_path = self._gz_objects.path_for_sha(sha)
+        with open(gz_path, 'wb') as f:
+            actual_sha = utils.sha1_and_gzip_path(planned_file.full_path, f)
+        if actual_sha != sha:
+            os.remove(gz_path)
+            raise Exception("File changed during bundle update: %s" % (planned_file.full_path))
+        file_info = self.catalog._import_gzipped(planned_file.full_path, sha, gz_path)
+        if file_info['format'] == Formats.GZ:
+            self._gz_objects.add(sha, gz_path)
+        else:
+            os.remove(gz_path)
+        return file_info
 
-        for root, dirs, files in os.walk(src_dir):
-            for f in files:
-                if f in IGNORE:
-                    continue  # TODO: real ignore
-                full_path = os.path.join(root, f)
-                rel_dir = root[len(src_dir) + 1:]
-                rel_path = os.path.join(rel_dir, f)
-
-                file_info = self.catalog.import_path(full_path)
-                if file_info is not None:
-                    filelist.add_file(rel_path, file_info['sha'])
-                    filelist.add_format_for_file(rel_path, file_info['format'], file_info['size'])
-
-                    if flavor_spec is not None:
-                        for flavor in flavor_spec.flavors:
-                            filter = flavor_spec.filter_for_flavor(flavor)
-                            if filter.match(full_path):
-                                filelist.add_flavor_for_file(rel_path, flavor)
-                else:
+    @staticmethod
+    def _formats_by_sha(manifest):
+        formats_by_sha = dict()
+        if manifest is not None:
+            for path in manifest.files.keys():
+                formats_by_sha[manifest.sha_for_file(path)] = manifest.formats_for_file(path)
+        return formats_by_sha
+
+    def _import_files(self, filelist, planned_files, previous_manifest=None):
+        """Imports the planned files into the catalog and adds their formats to
+        `filelist`. Objects referenced by `previous_manifest` are known to be
+        present and are not looked up in storage."""
+
+        known_formats_by_sha = self._formats_by_sha(previous_manifest)
+
+        # each new sha is only imported once, even if several paths share it
+        files_to_import = dict()
+        for planned_file in planned_files:
+            if planned_file.sha not in known_formats_by_sha:
+                files_to_import.setdefault(planned_file.sha, planned_file)
+
+        log.info("Importing %d of %d files." % (len(files_to_import), len(planned_files)))
+
+        # Compression and uploads are done in a pool. Results are consumed in
+        # path order, so the file list does not depend on the order in which
+        # the imports complete.
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            file_infos = executor.map(self._import_file, files_to_import.values())
+
+            for planned_file, file_info in zip(files_to_import.values(), file_infos):
+                if file_info is None:
                     # TODO: better error
                     raise Exception("we broke")
-
-        return filelist
+                known_formats_by_sha[planned_file.sha] = {
+                    file_info['format']: {'size': file_info['size']}
+                }
+
+        for planned_file in planned_files:
+            formats = known_formats_by_sha[planned_file.sha]
+            for format, format_info in formats.items():
+                filelist.add_format_for_file(planned_file.rel_path, format, format_info['size'])
+
+    def _update_hash_cache_from_manifest(self, manifest, planned_files):
+        for planned_file in planned_files:
+            if planned_file.st is None or planned_file.cached_info is not None:
+                continue
+            format, format_info = manifest.get_format_info_for_file(planned_file.rel_path)
+            if format is None:
+                continue
+            self.hash_cache.set(planned_file.full_path, planned_file.st, {
+                'sha': planned_file.sha,
+                'format': format,
+                'size': format_info['size'],
+            })
 
     def run(self):
 
@@ -84,18 +355,35 @@ class ZincBundleUpdateTask(object):
         assert self.bundle_name
         assert self.src_dir
 
-        filelist = self._import_files(self.src_dir, self.flavor_spec)
+        self._scratch_dir = tempfile.mkdtemp()
+        try:
+            utils.makedirs(self._objects_dir)
+            self._gz_objects = _ScratchObjects(self._objects_dir, None,
+                                               defaults['bundle_update_scratch_max_bytes'])
+            return self._run()
+        finally:
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+
+    def _run(self):
 
-        # Check if it matches the newest version
+        filelist, planned_files = self._plan_files(self.src_dir, self.flavor_spec)
+
+        # Check if it matches the newest version before touching storage
         # TODO: optionally check it if matches any existing versions?
 
+        existing_manifest = self.catalog.manifest_for_bundle(self.bundle_name)
+
         if not self.force:
-            existing_manifest = self.catalog.manifest_for_bundle(self.bundle_name)
             if existing_manifest is not None \
                and existing_manifest.files.contents_are_equalivalent(filelist):
                 log.info("Found existing version with same contents.")
+                if self.hash_cache is not None:
+                    self._update_hash_cache_from_manifest(existing_manifest, planned_files)
+                    self.hash_cache.save()
                 return existing_manifest
 
+        self._import_files(filelist, planned_files, previous_manifest=existing_manifest)
+
         # Build manifest
 
         version = self.catalog._reserve_version_for_bundle(self.bundle_name)
@@ -103,6 +391,12 @@ class ZincBundleUpdateTask(object):
         new_manifest.files = filelist.clone(mutable=True)
         # TODO move into setter?
 
+        # every hashed file is cached, including the ones that were not
+        # uploaded because their object was already known
+        if self.hash_cache is not None:
+            self._update_hash_cache_from_manifest(new_manifest, planned_files)
+            self.hash_cache.save()
+
         # Handle archives
 
         should_create_archives = len(filelist) > 1
@@ -119,15 +413,9 @@ class ZincBundleUpdateTask(object):
             if new_manifest.flavors is not None:
                 archive_flavors.extend(new_manifest.flavors)
 
-            for flavor in archive_flavors:
-                tmp_tar_path = self._build_archive(
-                    self.catalog, new_manifest, self.src_dir, flavor=flavor)
-                self.catalog._write_archive(
-                    self.bundle_name, new_manifest.version,
-                    tmp_tar_path, flavor=flavor)
-
-                # TODO: remove remove?
-                os.remove(tmp_tar_path)
+            # archive members are compressed from the source files, objects
+            # are never fetched from the catalog
+            self._write_archives(new_manifest, archive_flavors)
 
         self.catalog.update_bundle(new_manifest)
 
@@ -0,0 +1,214 @@
+import os
+import json
+import logging
+import time
+
+from zinc.defaults import defaults
+import zinc.helpers as helpers
+
+log = logging.getLogger(__name__)
+
+GC_STATE_FORMAT = 1
+
+# the catalog directories swept, in order
+_PHASES = ('manifests', 'archives', 'objects')
+
+
+def _bundle_version_for_descriptor(descriptor):
+    # strip the flavor of an archive, e.g. 'meep-1~small' -> 'meep-1'
+    return descriptor.split('~')[0]
+
+
+class ZincGarbageCollectTask(object):
+    """Removes manifests, archives and objects which are not referenced by any
+    bundle version in the index.
+
+    The live bundle versions and objects are determined from a snapshot of the
+    index taken under the catalog lock, then the catalog is swept without
+    holding the lock. The sweep is split into time-boxed slices: the progress
+    is stored in the catalog, so the next run continues where the previous one
+    stopped. Files written less than `grace_period` seconds before the
+    snapshot are never removed, which protects the objects and archives of
+    bundle updates that were in progress when the snapshot was taken.
+    """
+
+    def __init__(self,
+                 catalog=None,
+                 time_budget=None,
+                 grace_period=None,
+                 batch_size=None,
+                 dry_run=False,
+                 restart=False):
+
+        self.catalog = catalog
+        self.time_budget = time_budget
+        if grace_period is None:
+            grace_period = defaults['catalog_gc_grace_period']
+        self.grace_period = grace_period
+        self.batch_size = batch_size or defaults['catalog_gc_batch_size']
+        self.dry_run = dry_run
+        self.restart = restart
+
+        self._state = None
+        self._live_versions = None
+        self._live_objects = None
+
+    @property
+    def _storage(self):
+        return self.catalog._storage
+
+    @property
+    def _state_path(self):
+        return self.catalog.path_helper.path_for_gc_state()
+
+    def _dir_for_phase(self, phase):
+        return getattr(self.catalog.path_helper, '%s_dir' % (phase))
+
+    # State
+
+    def _load_state(self):
+        if self._storage.get_meta(self._state_path) is None:
+            return None
+        state = json.loads(self.catalog._read(self._state_path).decode('utf-8'))
+        if state.get('format') != GC_STATE_FORMAT:
+            return None
+        return state
+
+    def _save_state(self):
+        if self.dry_run:
+            return
+        self._state['versions'] = sorted(self._live_versions)
+        self._state['objects'] = sorted(self._live_objects)
+        self._storage.puts(self._state_path, json.dumps(self._state).encode('utf8'))
+
+    def _delete_state(self):
+        if not self.dry_run and self._storage.get_meta(self._state_path) is not None:
+            self._storage.delete(self._state_path)
+
+    def _versions_in_index(self, index):
+        return set("%s-%d" % (bundle_name, version)
+                   for bundle_name in index.bundle_names()
+                   for version in index.versions_for_bundle(bundle_name))
+
+    def _objects_for_versions(self, versions):
+        objects = set()
+        bundle_versions = [(helpers.bundle_id_from_bundle_descriptor(d),
+                            helpers.bundle_version_from_bundle_descriptor(d))
+                           for d in sorted(versions)]
+        manifests = self.catalog.get_manifests(bundle_versions)
+        for (bundle_name, version), manifest in zip(bundle_versions, manifests):
+            if manifest is None:
+                log.warn('Could not load manifest for %s-%d' % (bundle_name, version))
+                continue
+            objects.update(manifest.shas())
+        return objects
+
+    def _take_snapshot(self):
+        with self.catalog.lock():
+            # Readers of a journaled catalog see the last index snapshot,
+            # which can still reference versions deleted in the journal since.
+            if not self.dry_run:
+                self.catalog.compact_journal()
+            versions = self._versions_in_index(self.catalog.get_index())
+            started = time.time()
+
+        # Manifests are immutable, so live objects can be determined without
+        # holding the lock. Object references written meanwhile only add to
+        # the live objects.
+        refs = self.catalog._get_object_refs()
+        if refs is not None:
+            objects = refs.referenced_shas(self.catalog._object_refs_shard_names())
+        else:
+            objects = self._objects_for_versions(versions)
+
+        self._live_versions = versions
+        self._live_objects = objects
+        self._state = {
+            'format': GC_STATE_FORMAT,
+            'started': started,
+            'phase': _PHASES[0],
+            'cursor': None,
+        }
+        self._save_state()
+
+    def _refresh_live(self):
+        """Adds the bundle versions created since the snapshot, which may
+        reference objects that were unreferenced when it was taken."""
+        new_versions = self._versions_in_index(self.catalog.get_index()) - self._live_versions
+        if len(new_versions) > 0:
+            self._live_objects.update(self._objects_for_versions(new_versions))
+            self._live_versions.update(new_versions)
+
+    # Sweep
+
+    def _is_garbage(self, phase, f):
+        if phase == 'objects':
+            obj = os.path.splitext(os.path.basename(f))[0]
+            return obj not in self._live_objects
+        ext = '.tar' if phase == 'archives' else '.json'
+        if not (f.endswith(ext) or f.endswith(ext + '.gz')):
+            return True  # stray file
+        descriptor = os.path.basename(f).split('.')[0]
+        return _bundle_version_for_descriptor(descriptor) not in self._live_versions
+
+    def _is_in_grace_period(self, subpath):
+        meta = self._storage.get_meta(subpath)
+        if meta is None:
+            return True  # already gone
+        mtime = meta.get('mtime')
+        return mtime is None or mtime > self._state['started'] - self.grace_period
+
+    def _delete_batch(self, phase, batch):
+        if len(batch) == 0:
+            return
+        dir = self._dir_for_phase(phase)
+        # A bundle update may reuse an old object that was unreferenced when
+        # the snapshot was taken, so the batch is checked against the current
+        # index and deleted without letting new versions in between.
+        with self.catalog._read_lock():
+            self._refresh_live()
+            subpaths = [os.path.join(dir, f) for f in batch if self._is_garbage(phase, f)]
+            subpaths = [p for p in subpaths if not self._is_in_grace_period(p)]
+            verb = 'Would remove' if self.dry_run else 'Removing'
+            for subpath in subpaths:
+                log.info("%s %s" % (verb, subpath))
+            if not self.dry_run and len(subpaths) > 0:
+                self._storage.delete_many(subpaths)
+
+    def run(self):
+        """Sweeps the catalog until it is done or `time_budget` seconds have
+        passed. Returns `True` if the sweep is complete."""
+
+        deadline = time.time() + self.time_budget if self.time_budget else None
+
+        state = None if self.restart or self.dry_run else self._load_state()
+        if state is None:
+            self._take_snapshot()
+        else:
+            self._state = state
+            self._live_versions = set(state['versions'])
+            self._live_objects = set(state['objects'])
+
+        phases = _PHASES[_PHASES.index(self._state['phase']):]
+        for phase in phases:
+            self._state['phase'] = phase
+            batch = list()
+            dir = self._dir_for_phase(phase)
+            for f in self._storage.list(dir, marker=self._state['cursor']):
+                if self._is_garbage(phase, f):
+                    batch.append(f)
+                if len(batch) >= self.batch_size:
+                    self._delete_batch(phase, batch)
+                    batch = list()
+                self._state['cursor'] = f
+                if deadline is not None and time.time() > deadline:
+                    self._delete_batch(phase, batch)
+                    self._save_state()
+                    log.info("Time budget used up, stopped at %s/%s" % (phase, f))
+                    return False
+            self._delete_batch(phase, batch)
+            self._state['cursor'] = None
+            self._save_state()
+
+        self._delete_state()
+        return True
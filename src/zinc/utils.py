@@ -14,6 +14,9 @@ import hashlib
 import gzip
 import zlib
 import os
+import shutil
+import threading
+from collections import OrderedDict
 from io import BytesIO
 
 from types import GeneratorType
@@ -21,6 +24,9 @@ from itertools import tee
 
 Tee = tee([], 1)[0].__class__
 
+# Size of the blocks used when streaming file contents.
+CHUNK_SIZE = 1024 * 1024
+
 
 class EnumMC(type):
     def __contains__(self, val):
@@ -47,14 +53,95 @@ def memoized(f):
     return ret
 
 
+def _read_chunks(fileobj, chunk_size: int = CHUNK_SIZE):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache. It is bounded by the number of
+    entries and optionally by the total size of the entries, as reported by
+    the caller."""
+
+    def __init__(self, max_entries: int, max_size: int = None):
+        assert max_entries > 0
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int = 0) -> None:
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_size is not None and self._size > self.max_size and len(self._entries) > 1):
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+        return entry
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
 def sha1_for_path(path: str) -> str:
     """Returns the SHA1 hash as a string for the given path."""
     sha1 = hashlib.sha1()
-    f = open(path, 'rb')
-    try:
-        sha1.update(f.read())
-    finally:
-        f.close()
+    with open(path, 'rb') as f:
+        for chunk in _read_chunks(f):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def sha1_and_gzip_path(src_path: str, dst_fileobj) -> str:
+    """Reads `src_path` once, writing the gzipped contents to the file-like
+    object `dst_fileobj`. Returns the SHA1 hash of the uncompressed contents as
+    a string. Memory use is bounded by `CHUNK_SIZE`."""
+    sha1 = hashlib.sha1()
+    with open(src_path, 'rb') as f_in:
+        # an empty filename and mtime keep the gzipped bytes reproducible
+        with gzip.GzipFile(filename='', fileobj=dst_fileobj, mode='wb', mtime=0) as f_out:
+            for chunk in _read_chunks(f_in):
+                sha1.update(chunk)
+                f_out.write(chunk)
     return sha1.hexdigest()
 
 
@@ -78,20 +165,16 @@ def makedirs(path: str) -> str:
 
 def gzip_path(src_path: str, dst_path: str) -> None:
     """Convenience method for gzipping a file."""
-    f_in = open(src_path, 'rb')
-    f_out = gzip.open(dst_path, 'wb')
-    f_out.writelines(f_in)
-    f_out.close()
-    f_in.close()
+    with open(src_path, 'rb') as f_in:
+        with gzip.open(dst_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
 
 
 def gunzip_path(src_path: str, dst_path: str) -> None:
     """Convenience method for un-gzipping a file."""
-    f_in = gzip.open(src_path, 'rb')
-    f_out = open(dst_path, 'wb')
-    f_out.writelines(f_in)
-    f_out.close()
-    f_in.close()
+    with gzip.open(src_path, 'rb') as f_in:
+        with open(dst_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
 
 
 def gzip_bytes(bytes: bytes) -> bytes:
@@ -0,0 +1,45 @@
+import os
+
+from zinc.hashcache import HashCache
+
+from tests import TempDirTestCase, create_random_file
+
+
+class TestHashCache(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.dir, 'hashcache')
+        self.file_info = {'sha': 'ea502a7bbd407872e50b9328956277d0228272d4',
+                          'format': 'gz', 'size': 123}
+
+    def test_get_missing(self):
+        cache = HashCache(self.cache_path)
+        path = create_random_file(self.dir)
+        self.assertTrue(cache.get(path, os.stat(path)) is None)
+
+    def test_set_and_get(self):
+        cache = HashCache(self.cache_path)
+        path = create_random_file(self.dir)
+        cache.set(path, os.stat(path), self.file_info)
+        self.assertEqual(cache.get(path, os.stat(path)), self.file_info)
+
+    def test_modified_file_is_not_returned(self):
+        cache = HashCache(self.cache_path)
+        path = create_random_file(self.dir)
+        cache.set(path, os.stat(path), self.file_info)
+        with open(path, 'a') as f:
+            f.write('more')
+        self.assertTrue(cache.get(path, os.stat(path)) is None)
+
+    def test_save_and_load(self):
+        cache = HashCache(self.cache_path)
+        path = create_random_file(self.dir)
+        cache.set(path, os.stat(path), self.file_info)
+        cache.save()
+        cache2 = HashCache.from_path(self.cache_path)
+        self.assertEqual(cache2.get(path, os.stat(path)), self.file_info)
+
+    def test_load_missing(self):
+        cache = HashCache.from_path(os.path.join(self.dir, 'nope'))
+        self.assertEqual(len(cache), 0)
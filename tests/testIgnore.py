@@ -0,0 +1,70 @@
+import os
+import unittest
+
+from zinc.ignore import ZincIgnore
+
+from tests import TempDirTestCase
+
+
+class TestZincIgnoreMatching(unittest.TestCase):
+
+    def test_defaults(self):
+        ignore = ZincIgnore()
+        self.assertTrue(ignore.is_ignored('.DS_Store'))
+        self.assertTrue(ignore.is_ignored('a/b/.DS_Store'))
+        self.assertTrue(ignore.is_ignored('.zincignore'))
+        self.assertFalse(ignore.is_ignored('a/b/c.png'))
+
+    def test_basename_pattern_matches_at_any_depth(self):
+        ignore = ZincIgnore(['*.tmp'])
+        self.assertTrue(ignore.is_ignored('a.tmp'))
+        self.assertTrue(ignore.is_ignored('x/y/a.tmp'))
+        self.assertFalse(ignore.is_ignored('a.tmp.png'))
+
+    def test_anchored_pattern(self):
+        ignore = ZincIgnore(['/build', 'docs/*.md'])
+        self.assertTrue(ignore.is_ignored('build', is_dir=True))
+        self.assertFalse(ignore.is_ignored('src/build', is_dir=True))
+        self.assertTrue(ignore.is_ignored('docs/a.md'))
+        self.assertFalse(ignore.is_ignored('docs/x/a.md'))
+
+    def test_dir_only_pattern(self):
+        ignore = ZincIgnore(['cache/'])
+        self.assertTrue(ignore.is_ignored('a/cache', is_dir=True))
+        self.assertFalse(ignore.is_ignored('a/cache'))
+        self.assertTrue(ignore.is_ignored('a/cache/file'))
+
+    def test_double_star(self):
+        ignore = ZincIgnore(['a/**/z'])
+        self.assertTrue(ignore.is_ignored('a/z'))
+        self.assertTrue(ignore.is_ignored('a/b/c/z'))
+        self.assertFalse(ignore.is_ignored('b/a/z'))
+
+    def test_negation(self):
+        ignore = ZincIgnore(['*.png', '!keep.png', '# comment', ''])
+        self.assertTrue(ignore.is_ignored('a/b.png'))
+        self.assertFalse(ignore.is_ignored('a/keep.png'))
+
+    def test_negation_inside_ignored_dir(self):
+        ignore = ZincIgnore(['cache/', '!cache/keep.png'])
+        self.assertTrue(ignore.is_ignored('cache/keep.png'))
+
+
+class TestZincIgnoreWalk(TempDirTestCase):
+
+    def _touch(self, rel_path):
+        path = os.path.join(self.dir, rel_path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def test_walk_prunes_ignored_dirs(self):
+        self._touch('a.png')
+        self._touch('.DS_Store')
+        self._touch('cache/big.bin')
+        self._touch('sub/b.png')
+        with open(os.path.join(self.dir, '.zincignore'), 'w') as f:
+            f.write('cache/\n')
+        ignore = ZincIgnore.from_dir(self.dir)
+        rel_paths = sorted(rel_path for (full_path, rel_path) in ignore.walk(self.dir))
+        self.assertEqual(rel_paths, ['a.png', 'sub/b.png'])
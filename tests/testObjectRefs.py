@@ -0,0 +1,39 @@
+import unittest
+
+from zinc.refs import ObjectRefs, object_refs_shard_for_sha
+
+
+class TestObjectRefs(unittest.TestCase):
+
+    def setUp(self):
+        self.sha1 = 'ea502a7bbd407872e50b9328956277d0228272d4'
+        self.sha2 = '3f786850e387550fdab836ed7e6dc881de23001b'
+
+    def test_add_refs(self):
+        refs = ObjectRefs()
+        refs.add_refs("meep", 1, [self.sha1, self.sha2])
+        refs.add_refs("meep", 2, [self.sha1])
+        self.assertEqual(refs.refs_for_sha(self.sha1), [["meep", 1], ["meep", 2]])
+        self.assertEqual(refs.refcount(self.sha2), 1)
+
+    def test_removals_are_applied_later(self):
+        refs = ObjectRefs()
+        refs.add_refs("meep", 1, [self.sha1])
+        refs.remove_refs("meep", 1, [self.sha1])
+        self.assertEqual(refs.refcount(self.sha1), 1)
+        refs.apply_removals()
+        self.assertEqual(refs.refcount(self.sha1), 0)
+
+    def test_changed_shards_round_trip(self):
+        refs = ObjectRefs()
+        refs.add_refs("meep", 1, [self.sha1, self.sha2])
+        changed = refs.pop_changed_shards()
+        self.assertEqual(sorted(changed.keys()),
+                         sorted([object_refs_shard_for_sha(self.sha1),
+                                 object_refs_shard_for_sha(self.sha2)]))
+        self.assertEqual(refs.pop_changed_shards(), dict())
+
+        loaded = ObjectRefs(load_shard=lambda shard: ObjectRefs.shard_from_bytes(changed[shard])
+                            if shard in changed else None)
+        self.assertEqual(loaded.refs_for_sha(self.sha1), [["meep", 1]])
+        self.assertEqual(loaded.referenced_shas(changed.keys()), set([self.sha1, self.sha2]))
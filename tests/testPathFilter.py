@@ -1,6 +1,6 @@
 import unittest
 
-from zinc.pathfilter import PathFilter
+from zinc.pathfilter import PathFilter, PathFilterGroup
 from zinc.pathfilter import Match
 
 
@@ -60,6 +60,24 @@ class TestPathFilterMatching(unittest.TestCase):
         self.assertFalse(pf.match('/this/is/valid/100/file.jpg'))
         self.assertTrue(pf.match('/this/is/not/valid/20/file.png'))
 
+    def test_first_matching_rule_wins(self):
+        pf = PathFilter([
+            PathFilter.Rule('*/100/*.png', Match.REJECT),
+            PathFilter.Rule('*/100/*', Match.ACCEPT),
+            PathFilter.Rule('*', Match.REJECT)])
+        self.assertFalse(pf.match('/this/is/100/file.png'))
+        self.assertTrue(pf.match('/this/is/100/file.jpg'))
+        self.assertFalse(pf.match('/this/is/20/file.jpg'))
+
+    def test_rules_with_multiple_wildcards(self):
+        pf = PathFilter([
+            PathFilter.Rule('*/a*b/*', Match.REJECT),
+            PathFilter.Rule('*/c*d/*', Match.ACCEPT),
+            PathFilter.Rule('*', Match.REJECT)])
+        self.assertFalse(pf.match('/x/a1b/c1d/f'))
+        self.assertTrue(pf.match('/x/c1d/f'))
+        self.assertFalse(pf.match('/x/e1f/f'))
+
     def test_read_json(self):
         pf = PathFilter.from_rule_list(['+ a'])
         self.assertTrue(pf is not None)
@@ -68,3 +86,17 @@ class TestPathFilterMatching(unittest.TestCase):
 
     def test_read_json_invalid(self):
         self.assertRaises(Exception, PathFilter.from_rule_list, ['? a'])
+
+
+class TestPathFilterGroup(unittest.TestCase):
+
+    def test_matches_each_filter(self):
+        filters = [
+            PathFilter.from_rule_list(['- */100/*.png', '+ */100/*', '- *']),
+            PathFilter.from_rule_list(['+ */a*b/*', '- *']),
+            PathFilter.from_rule_list([]),
+            PathFilter.from_rule_list(['- *.jpg']),
+        ]
+        group = PathFilterGroup(filters)
+        for path in ('/x/100/f.png', '/x/100/f.jpg', '/x/a1b/100/f.jpg', '/x/20/f.txt'):
+            self.assertEqual(group.match(path), [f.match(path) for f in filters])
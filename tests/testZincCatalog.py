@@ -2,16 +2,24 @@ import unittest
 import os
 import logging
 import json
+import shutil
+import hashlib
+import tarfile
+from unittest import mock
 
-from zinc.models import ZincIndex, ZincManifest, ZincFlavorSpec
+from zinc.models import ZincIndex, ZincManifest, ZincFlavorSpec, index_shard_for_bundle, INDEX_LAYOUT_SHARDED
 from zinc.catalog import ZincCatalogPathHelper
 from zinc.defaults import defaults
 from zinc.catalog import ZincCatalog
 from zinc.storages import StorageBackend
+from zinc.storages.filesystem import FilesystemStorageBackend
+from zinc.coordinators.filesystem import FilesystemCatalogCoordinator
+from zinc.hashcache import HashCache
 
-from zinc.client import connect, create_bundle_version
+from zinc.client import connect, create_bundle_version, apply_batch, collect_garbage
 
 import zinc.helpers as helpers
+import zinc.utils as utils
 
 from tests import TempDirTestCase, create_random_file
 
@@ -32,6 +40,40 @@ class StorageBackendTestCase(unittest.TestCase):
         self.assertRaises(NotImplementedError, self.storage.put, 'foo', 'bar')
 
 
+class FilesystemStorageBackendTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage = FilesystemStorageBackend(url=utils.file_url(self.dir))
+
+    def test_open_for_write(self):
+        with self.storage.open_for_write('a/b') as f:
+            f.write(b'hello')
+        with self.storage.get('a/b') as f:
+            self.assertEqual(f.read(), b'hello')
+
+    def test_open_for_write_error_does_not_write(self):
+        try:
+            with self.storage.open_for_write('a/b') as f:
+                f.write(b'hello')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(self.storage.get_meta('a/b') is None)
+
+    def test_list_with_marker(self):
+        for subpath in ('d/c', 'd/a', 'd/b'):
+            self.storage.puts(subpath, b'x')
+        self.assertEqual(self.storage.list('d'), ['a', 'b', 'c'])
+        self.assertEqual(self.storage.list('d', marker='a'), ['b', 'c'])
+
+    def test_delete_many(self):
+        for subpath in ('a', 'b'):
+            self.storage.puts(subpath, b'x')
+        self.storage.delete_many(['a', 'b'])
+        self.assertEqual(self.storage.list(''), [])
+
+
 def create_catalog_at_path(path, id):
     service = connect('/')
     service.create_catalog(id=id, loc=path)
@@ -92,6 +134,210 @@ class ZincCatalogTestCase(TempDirTestCase):
         f1 = create_random_file(self.scratch_dir)
         catalog.import_path(f1)
 
+    def test_catalog_import_file_gz(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        f1 = create_random_file(self.scratch_dir, size=8192)
+        file_info = catalog.import_path(f1)
+        self.assertEqual(file_info['format'], 'gz')
+        self.assertEqual(file_info['sha'], utils.sha1_for_path(f1))
+        with catalog._read_file(file_info['sha'], ext='gz') as f:
+            b = utils.gunzip_bytes(f.read())
+        with open(f1, 'rb') as f:
+            self.assertEqual(b, f.read())
+
+    def test_reload_skips_unchanged_index(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        with mock.patch.object(catalog, '_read_index',
+                               wraps=catalog._read_index) as read_index:
+            catalog._reload()
+            self.assertFalse(read_index.called)
+            with catalog.lock():
+                pass
+            self.assertFalse(read_index.called)
+
+    def test_reload_reads_changed_index(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        other_catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        create_random_file(self.scratch_dir)
+        create_bundle_version(other_catalog, "meep", self.scratch_dir)
+        catalog._reload()
+        self.assertTrue("meep" in catalog.index.bundle_names())
+
+    def _get_catalog(self, **kwargs):
+        url = utils.file_url(self.catalog_dir)
+        return ZincCatalog(storage=FilesystemStorageBackend(url=url),
+                           coordinator=FilesystemCatalogCoordinator(url=url),
+                           **kwargs)
+
+    def test_sharded_index(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertTrue(self.path_exists_in_catalog(catalog.path_helper.path_for_index_root()))
+        # unsharded catalogs switch to the shards
+        other_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        self.assertTrue(other_catalog.index.is_sharded)
+        self.assertEqual(other_catalog.index.versions_for_bundle("meep"), [1])
+        # the single file index only points to the shards
+        index_path = os.path.join(self.catalog_dir, defaults['catalog_index_name'])
+        self.assertEqual(ZincIndex.from_path(index_path).layout, INDEX_LAYOUT_SHARDED)
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [])
+        # unless it is written for clients that do not support shards
+        with mock.patch.dict(defaults, {'catalog_write_single_file_index': True}):
+            catalog.update_distribution("master", "meep", 1)
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [1])
+
+    def test_sharded_index_write_reads_only_changed_shards(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        for i in range(50):
+            catalog.index.add_version_for_bundle("bundle%d" % (i), 1)
+        catalog.save()
+        other_catalog = self._get_catalog(sharded_index=True)
+        other_catalog.update_distribution("master", "bundle1", 1)
+        with mock.patch.object(ZincCatalog, '_read_index_shard', autospec=True,
+                               side_effect=ZincCatalog._read_index_shard) as read_shard:
+            catalog.update_distribution("master", "bundle2", 1)
+        self.assertEqual(read_shard.call_count, 1)
+
+    def test_sharded_index_loads_shards_lazily(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        catalog.index.add_version_for_bundle("meep", 1)
+        catalog.index.add_version_for_bundle("bork", 1)
+        catalog.save()
+        with mock.patch.object(ZincCatalog, '_read_index_shard', autospec=True,
+                               side_effect=ZincCatalog._read_index_shard) as read_shard:
+            other_catalog = self._get_catalog(sharded_index=True)
+            self.assertEqual(read_shard.call_count, 0)
+            self.assertEqual(other_catalog.index.versions_for_bundle("meep"), [1])
+            self.assertEqual(read_shard.call_count, 1)
+
+    def test_sharded_index_snapshot_is_isolated(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        catalog.index.add_version_for_bundle("meep", 1)
+        catalog.save()
+        reader = self._get_catalog(sharded_index=True)
+        snapshot = reader.get_index()
+        catalog.update_distribution("master", "meep", 1)
+        # the snapshot still reads the shard it was taken with
+        self.assertEqual(snapshot.versions_for_bundle("meep"), [1])
+        self.assertTrue(snapshot.version_for_bundle("meep", "master") is None)
+        reader._reload()
+        self.assertEqual(reader.get_index().version_for_bundle("meep", "master"), 1)
+
+    def test_clean_removes_unreferenced_index_shards(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        catalog.update_distribution("master", "meep", 1)
+        shards_dir = os.path.join(self.catalog_dir, catalog.path_helper.index_shards_dir)
+        shard_files = os.listdir(shards_dir)
+        self.assertTrue(len(shard_files) > 2)
+        # shards are kept while readers may still use an older root
+        catalog.clean()
+        self.assertEqual(sorted(os.listdir(shards_dir)), sorted(shard_files))
+        with mock.patch.dict(defaults, {'catalog_index_max_age_seconds': -10}):
+            catalog.clean()
+        self.assertEqual(len(os.listdir(shards_dir)), 2)
+        other_catalog = self._get_catalog(sharded_index=True)
+        self.assertEqual(other_catalog.index.version_for_bundle("meep", "master"), 1)
+
+    def test_sharded_index_only_writes_changed_shards(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(sharded_index=True)
+        catalog.index.add_version_for_bundle("meep", 1)
+        catalog.index.add_version_for_bundle("bork", 1)
+        catalog.save()
+        ph = catalog.path_helper
+        with mock.patch.object(catalog, '_put_many', wraps=catalog._put_many) as put_many:
+            catalog.update_distribution("master", "meep", 1)
+            written = [subpath for c in put_many.call_args_list for subpath, _ in c[0][0]]
+        shard_name = index_shard_for_bundle("meep", defaults['catalog_index_shard_prefix_length'])
+        shard = ph.path_for_index_shard(shard_name, catalog.index.to_shard_root_dict()['shards'][shard_name])
+        shards = [p for p in written if p.startswith(os.path.join(ph.index_dir, 'shards'))]
+        self.assertEqual(shards, [shard, shard + '.gz'])
+        self.assertTrue(ph.path_for_index_root() in written)
+
+    def test_journal(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(journal=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertTrue(self.path_exists_in_catalog(catalog.path_helper.path_for_journal_head()))
+        # the snapshot is only updated when the journal is compacted
+        index_path = os.path.join(self.catalog_dir, defaults['catalog_index_name'])
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [])
+        # unjournaled catalogs switch to the journal
+        other_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        self.assertEqual(other_catalog.index.versions_for_bundle("meep"), [1])
+
+    def test_journal_reload_replays_new_records(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(journal=True)
+        catalog.save()
+        other_catalog = self._get_catalog(journal=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(other_catalog, "meep", self.scratch_dir)
+        with mock.patch.object(catalog, '_read_index') as read_index:
+            catalog._reload()
+            self.assertFalse(read_index.called)
+        self.assertEqual(catalog.index.versions_for_bundle("meep"), [1])
+
+    def test_journal_compaction(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(journal=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        with mock.patch.dict(defaults, {'catalog_index_journal_compaction_threshold': 2}):
+            for distro in ('a', 'b', 'c'):
+                catalog.update_distribution(distro, "meep", 1)
+        index_path = os.path.join(self.catalog_dir, defaults['catalog_index_name'])
+        snapshot = ZincIndex.from_path(index_path)
+        self.assertEqual(snapshot.journal_seq, catalog.index.journal_seq)
+        self.assertEqual(snapshot.version_for_bundle("meep", "c"), 1)
+        # records before the previous snapshot were deleted
+        ph = catalog.path_helper
+        self.assertFalse(self.path_exists_in_catalog(ph.path_for_journal_record(1)))
+        other_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        self.assertEqual(other_catalog.index.to_dict(), catalog.index.to_dict())
+
+    def test_clean_compacts_journal(self):
+        create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog = self._get_catalog(journal=True)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        catalog.compact_journal()
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        catalog.delete_bundle_version("meep", 1)
+        index_path = os.path.join(self.catalog_dir, defaults['catalog_index_name'])
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [1])
+        catalog.clean()
+        # the snapshot no longer references the collected version
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [2])
+
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        catalog.delete_bundle_version("meep", 2)
+        self.assertTrue(collect_garbage(catalog, grace_period=0))
+        self.assertEqual(ZincIndex.from_path(index_path).versions_for_bundle("meep"), [3])
+
+    def test_save_gzips_index_once(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        catalog.index.add_version_for_bundle("meep", 1)
+        with mock.patch('zinc.utils.gzip_bytes', wraps=utils.gzip_bytes) as gzip_bytes:
+            with mock.patch.dict(defaults, {'catalog_write_legacy_index': True}):
+                catalog.save()
+            self.assertEqual(gzip_bytes.call_count, 1)
+        for subpath in (defaults['catalog_index_name'], 'index.json'):
+            with open(os.path.join(self.catalog_dir, subpath + '.gz'), 'rb') as f:
+                index = ZincIndex.from_bytes(utils.gunzip_bytes(f.read()).decode('utf-8'))
+            self.assertEqual(index.versions_for_bundle("meep"), [1])
+
     def test_bundle_names_with_no_bundles(self):
         catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
         self.assertTrue(len(catalog.index.bundle_names()) == 0)
@@ -125,6 +371,26 @@ class ZincCatalogTestCase(TempDirTestCase):
                 object_path = ZincCatalogPathHelper().path_for_file_with_sha(sha, ext)
                 self.assertTrue(self.path_exists_in_catalog(object_path))
 
+    def test_get_manifest_is_cached(self):
+        catalog = self._build_test_catalog()
+        manifest1 = catalog.get_manifest("meep", 1)
+        manifest2 = catalog.get_manifest("meep", 1)
+        self.assertTrue(manifest1 is manifest2)
+        self.assertFalse(manifest1.is_mutable)
+        self.assertFalse(manifest1.files.is_mutable)
+        self.assertTrue(catalog.manifest_cache.hits >= 1)
+
+    def test_get_index_snapshot(self):
+        catalog = self._build_test_catalog()
+        index1 = catalog.get_index()
+        self.assertTrue(index1 is catalog.get_index())
+        self.assertFalse(index1.is_mutable)
+        catalog.update_distribution("master", "meep", 1)
+        index2 = catalog.get_index()
+        self.assertFalse(index1 is index2)
+        self.assertEqual(index2.version_for_bundle("meep", "master"), 1)
+        self.assertTrue(index1.version_for_bundle("meep", "master") is None)
+
     def test_bundle_name_in_manifest(self):
         catalog = self._build_test_catalog()
         bundle_name = "meep"
@@ -138,6 +404,55 @@ class ZincCatalogTestCase(TempDirTestCase):
         catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
         create_bundle_version(catalog, "meep", self.scratch_dir)
 
+    def test_create_bundle_version_with_jobs(self):
+        for i in range(4):
+            create_random_file(self.scratch_dir)
+        sub_dir = os.path.join(self.scratch_dir, "one")
+        os.mkdir(sub_dir)
+        for i in range(4):
+            create_random_file(sub_dir)
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        manifest1 = create_bundle_version(catalog, "meep", self.scratch_dir, jobs=1)
+        manifest2 = create_bundle_version(catalog, "beep", self.scratch_dir, jobs=4)
+        self.assertEqual(manifest1.files.to_dict(), manifest2.files.to_dict())
+        self.assertEqual(list(manifest1.files.keys()), list(manifest2.files.keys()))
+
+    def test_create_bundle_version_with_hash_cache(self):
+        create_random_file(self.scratch_dir)
+        create_random_file(self.scratch_dir)
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        cache_path = os.path.join(self.dir, 'hashcache')
+        manifest1 = create_bundle_version(catalog, "meep", self.scratch_dir,
+                                          hash_cache=HashCache.from_path(cache_path))
+        self.assertTrue(os.path.exists(cache_path))
+        hash_cache = HashCache.from_path(cache_path)
+        self.assertEqual(len(hash_cache), 2)
+        with mock.patch('zinc.utils.sha1_for_path', wraps=utils.sha1_for_path) as sha1_for_path:
+            manifest2 = create_bundle_version(catalog, "meep", self.scratch_dir,
+                                              hash_cache=hash_cache)
+            # both files hit the cache
+            self.assertFalse(sha1_for_path.called)
+        self.assertEqual(manifest1.version, manifest2.version)
+
+        # only the new file is hashed
+        new_path = create_random_file(self.scratch_dir)
+        with mock.patch('zinc.utils.sha1_for_path', wraps=utils.sha1_for_path) as sha1_for_path:
+            create_bundle_version(catalog, "meep", self.scratch_dir, hash_cache=hash_cache)
+            sha1_for_path.assert_called_once_with(new_path)
+
+    def test_hash_cache_records_files_that_are_not_uploaded(self):
+        paths = [create_random_file(self.scratch_dir) for i in range(3)]
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        # two copies of a known object and one new file
+        for i in range(2):
+            shutil.copy(paths[0], os.path.join(self.scratch_dir, 'copy%d' % (i)))
+        create_random_file(self.scratch_dir)
+        cache_path = os.path.join(self.dir, 'hashcache')
+        create_bundle_version(catalog, "meep", self.scratch_dir,
+                              hash_cache=HashCache.from_path(cache_path))
+        self.assertEqual(len(HashCache.from_path(cache_path)), 6)
+
     def test_create_second_bundle_version(self):
         catalog = self._build_test_catalog()
         # add a file
@@ -176,6 +491,43 @@ class ZincCatalogTestCase(TempDirTestCase):
         create_bundle_version(catalog, "meep", self.scratch_dir)
         self.assertEqual(len(catalog.get_index().versions_for_bundle("meep")), 1)
 
+    def test_create_identical_bundle_version_does_not_touch_objects(self):
+        catalog = self._build_test_catalog()
+        with mock.patch.object(catalog._storage, 'put') as put, \
+                mock.patch.object(catalog._storage, 'get_meta') as get_meta:
+            manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertEqual(manifest.version, 1)
+        self.assertFalse(put.called)
+        self.assertFalse(get_meta.called)
+
+    def test_create_second_bundle_version_only_imports_new_files(self):
+        catalog = self._build_test_catalog()
+        new_file = create_random_file(self.scratch_dir)
+        with mock.patch.object(catalog, '_import_gzipped',
+                               wraps=catalog._import_gzipped) as import_gzipped:
+            manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertEqual(manifest.version, 2)
+        self.assertEqual(import_gzipped.call_count, 1)
+        self.assertEqual(import_gzipped.call_args[0][0], new_file)
+        for path in manifest.files.keys():
+            self.assertTrue(manifest.formats_for_file(path))
+
+    def test_archive_members_match_catalog_objects(self):
+        catalog = self._build_test_catalog()
+        create_random_file(self.scratch_dir, size=8192)
+        # archive members are compressed locally, not fetched from storage
+        with mock.patch.object(catalog, '_read_file') as read_file:
+            manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+            self.assertFalse(read_file.called)
+        with catalog._read_archive("meep", manifest.version) as fileobj:
+            with tarfile.open(fileobj=fileobj) as tar:
+                self.assertEqual(len(tar.getnames()), len(manifest.files))
+                for member in tar.getmembers():
+                    sha, _, ext = member.name.partition('.')
+                    self.assertEqual(ext, 'gz')
+                    with catalog._read_file(sha, ext=ext) as f:
+                        self.assertEqual(tar.extractfile(member).read(), f.read())
+
     def test_path_for_manifest_with_name_version(self):
         catalog = self._build_test_catalog()
         manifest = ZincManifest(catalog.index.id, 'zoo', 1)
@@ -226,6 +578,47 @@ class ZincCatalogTestCase(TempDirTestCase):
         archive_path = ZincCatalogPathHelper().path_for_archive_for_bundle_version("meep", 1)
         self.assertFalse(self.path_exists_in_catalog(archive_path))
 
+    def test_flavor_archives_built_concurrently(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        for i in range(4):
+            create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({
+            'one': ['+ *'], 'two': ['+ *'], 'three': ['+ *']})
+        create_bundle_version(catalog, "meep", self.scratch_dir,
+                              flavor_spec=flavor_spec, archive_jobs=3)
+        for flavor in ('one', 'two', 'three'):
+            archive_path = ZincCatalogPathHelper().path_for_archive_for_bundle_version("meep", 1, flavor=flavor)
+            self.assertTrue(self.path_exists_in_catalog(archive_path))
+
+    def test_flavor_archive_members_compressed_once(self):
+        catalog = create_catalog_at_path(self.catalog_dir, 'com.mindsnacks.test')
+        for i in range(4):
+            create_random_file(self.scratch_dir)
+        flavor_spec = ZincFlavorSpec.from_dict({
+            'one': ['+ *'], 'two': ['+ *'], 'three': ['+ *']})
+        archive_names = dict()
+        # within and over the scratch space budget
+        for max_bytes in (defaults['bundle_update_scratch_max_bytes'], 0):
+            with mock.patch.dict(defaults, {'bundle_update_scratch_max_bytes': max_bytes}), \
+                    mock.patch('zinc.utils.sha1_and_gzip_path',
+                               wraps=utils.sha1_and_gzip_path) as sha1_and_gzip_path:
+                manifest = create_bundle_version(catalog, "meep", self.scratch_dir,
+                                                 flavor_spec=flavor_spec, force=True,
+                                                 archive_jobs=3)
+            compressed = [c[0][0] for c in sha1_and_gzip_path.call_args_list]
+            if max_bytes > 0:
+                # the copies made while importing are reused
+                self.assertEqual(sorted(compressed),
+                                 sorted(os.path.join(self.scratch_dir, f) for f in os.listdir(self.scratch_dir)))
+            else:
+                self.assertEqual(len(compressed), len(set(compressed)))
+            for flavor in (None, 'one', 'two', 'three'):
+                with catalog._read_archive("meep", manifest.version, flavor=flavor) as fileobj:
+                    with tarfile.open(fileobj=fileobj) as tar:
+                        archive_names.setdefault(flavor, set()).add(tuple(tar.getnames()))
+        for names in archive_names.values():
+            self.assertEqual(len(names), 1)
+
     def test_update_distro_basic(self):
         # set up
         catalog = self._build_test_catalog()
@@ -276,6 +669,248 @@ class ZincCatalogTestCase(TempDirTestCase):
         subpath = catalog.path_helper.path_for_flavorspec_name(flavorspec_name)
         catalog._storage.puts(subpath, flavorspec_string.encode('utf8'))
 
+    def test_transaction_writes_index_once(self):
+        catalog = self._build_test_catalog()
+        with mock.patch.object(catalog, '_write_index', wraps=catalog._write_index) as write_index:
+            with catalog.transaction():
+                catalog.update_distribution("master", "meep", 1)
+                catalog.update_distribution("test", "meep", 1)
+            self.assertEqual(write_index.call_count, 1)
+        self.assertEqual(catalog.index.version_for_bundle("meep", "test"), 1)
+
+    def test_transaction_discards_changes_on_error(self):
+        catalog = self._build_test_catalog()
+        try:
+            with catalog.transaction():
+                catalog.update_distribution("master", "meep", 1)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue(catalog.index.version_for_bundle("meep", "master") is None)
+        self.assertFalse(catalog.lock().is_locked())
+
+    def test_apply_batch(self):
+        catalog = self._build_test_catalog()
+        catalog.update_distribution("old", "meep", 1)
+        catalog.update_distribution("_old", "meep", 1)
+        lines = [
+            "# promote",
+            "distro:update meep master 1",
+            "",
+            "distro:update meep test :latest",
+            "distro:delete meep old",
+        ]
+        apply_batch(catalog, lines)
+        self.assertEqual(catalog.index.version_for_bundle("meep", "master"), 1)
+        self.assertEqual(catalog.index.version_for_bundle("meep", "test"), 1)
+        self.assertTrue(catalog.index.version_for_bundle("meep", "old") is None)
+
+    def test_apply_batch_invalid_operation_applies_nothing(self):
+        catalog = self._build_test_catalog()
+        lines = ["distro:update meep master 1", "distro:frob meep"]
+        self.assertRaises(ValueError, apply_batch, catalog, lines)
+        self.assertTrue(catalog.index.version_for_bundle("meep", "master") is None)
+
+    def test_apply_batch_unresolvable_version_applies_nothing(self):
+        catalog = self._build_test_catalog()
+        for bad_line in ["distro:update meep test 2",
+                         "distro:update nope test :latest",
+                         "distro:update meep test @missing",
+                         "distro:delete nope master",
+                         "distro:delete meep missing"]:
+            lines = ["distro:update meep master 1", bad_line]
+            with self.assertRaisesRegex(ValueError, "^Line 2: "):
+                apply_batch(catalog, lines)
+            self.assertTrue(catalog.index.version_for_bundle("meep", "master") is None)
+
+    def test_apply_batch_resolves_distros_updated_earlier(self):
+        catalog = self._build_test_catalog()
+        lines = ["distro:update meep master 1", "distro:update meep test @master"]
+        apply_batch(catalog, lines)
+        self.assertEqual(catalog.index.version_for_bundle("meep", "test"), 1)
+
+    def test_apply_batch_delete_without_previous_distro(self):
+        catalog = self._build_test_catalog()
+        lines = ["distro:update meep master 1", "distro:delete meep master"]
+        apply_batch(catalog, lines)
+        self.assertTrue(catalog.index.version_for_bundle("meep", "master") is None)
+
+    def test_index_records_manifest_digest(self):
+        catalog = self._build_test_catalog()
+        manifest = catalog.get_manifest("meep", 1)
+        index = catalog.get_index()
+        self.assertEqual(index.digest_for_bundle_version("meep", 1), manifest.digest)
+        self.assertIsNone(index.digest_for_bundle_version("meep", 2))
+
+    def test_diff_manifests(self):
+        catalog = self._build_test_catalog()
+        path = create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        diffs = list(catalog.diff_manifests("meep", 1, 2))
+        self.assertEqual(len(diffs), 1)
+        self.assertEqual(diffs[0].path, os.path.basename(path))
+        self.assertEqual(diffs[0].change, 'added')
+        self.assertTrue(diffs[0].size_delta > 0)
+        self.assertEqual(list(catalog.diff_manifests("meep", 2, 2)), [])
+
+    def test_get_manifests(self):
+        catalog = self._build_test_catalog()
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        manifests = list(catalog.get_manifests([("meep", 2), ("meep", 1)], jobs=2))
+        self.assertEqual([m.version for m in manifests], [2, 1])
+        self.assertEqual(manifests[1], catalog.get_manifest("meep", 1))
+        self.assertEqual(list(catalog.get_manifests([])), [])
+
+    def test_get_manifests_fetches_ahead_boundedly(self):
+        catalog = self._build_test_catalog()
+        for i in range(4):
+            create_random_file(self.scratch_dir)
+            create_bundle_version(catalog, "meep", self.scratch_dir)
+        requested = list()
+
+        def bundle_versions():
+            for version in range(1, 6):
+                requested.append(version)
+                yield ("meep", version)
+
+        manifests = catalog.get_manifests(bundle_versions(), jobs=2)
+        self.assertEqual(next(manifests).version, 1)
+        # only the manifests being fetched ahead were requested
+        self.assertEqual(requested, [1, 2])
+        self.assertEqual([m.version for m in manifests], [2, 3, 4, 5])
+
+    def test_object_refs(self):
+        catalog = self._build_test_catalog()
+        self.assertFalse(catalog.has_object_refs)
+        catalog.rebuild_object_refs()
+        manifest1 = catalog.get_manifest("meep", 1)
+        sha = manifest1.sha_for_file(list(manifest1.files.keys())[0])
+        self.assertEqual(catalog.object_refs_for_sha(sha), [["meep", 1]])
+
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        other_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        self.assertTrue(other_catalog.has_object_refs)
+        self.assertEqual(other_catalog.object_refs_for_sha(sha), [["meep", 1], ["meep", 2]])
+
+        catalog.delete_bundle_version("meep", 1)
+        other_catalog._reload()
+        self.assertEqual(other_catalog.object_refs_for_sha(sha), [["meep", 2]])
+
+    def test_object_refs_rebuilt_by_other_catalog(self):
+        catalog = self._build_test_catalog()
+
+        def content_version_token(catalog):
+            # like an S3 ETag, only changes with the content
+            with catalog._storage.get(catalog._path_for_index_version_token()) as f:
+                return hashlib.md5(f.read()).hexdigest()
+
+        with mock.patch.object(ZincCatalog, '_get_index_version_token', autospec=True,
+                               side_effect=content_version_token):
+            catalog._reload()
+            self.assertFalse(catalog.has_object_refs)
+            other_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+            other_catalog.rebuild_object_refs()
+
+            # the long-lived catalog picks up the new refs on its next write
+            path = create_random_file(self.scratch_dir)
+            manifest = create_bundle_version(catalog, "meep", self.scratch_dir)
+        self.assertTrue(catalog.has_object_refs)
+        sha = manifest.sha_for_file(os.path.basename(path))
+        fresh_catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        self.assertEqual(fresh_catalog.object_refs_for_sha(sha), [["meep", 2]])
+
+    def test_unchanged_lock_round_trip_reads_only_token(self):
+        self._build_test_catalog()
+        for journal in (False, True):
+            catalog = self._get_catalog(journal=journal)
+            catalog.rebuild_object_refs()
+            self.assertTrue(catalog.has_object_refs)
+            storage = catalog._storage
+            with mock.patch.object(storage, 'get_meta', wraps=storage.get_meta) as get_meta, \
+                    mock.patch.object(storage, 'get', wraps=storage.get) as get:
+                with catalog.lock():
+                    pass
+            get_meta.assert_called_once_with(catalog._path_for_index_version_token())
+            self.assertFalse(get.called)
+
+    def test_clean_with_object_refs(self):
+        catalog = self._build_test_catalog()
+        catalog.rebuild_object_refs()
+        manifest = catalog.get_manifest("meep", 1)
+        f = create_random_file(self.scratch_dir)
+        unreferenced = catalog.import_path(f)['sha']
+        # a fresh catalog has no cached manifests
+        catalog = connect('/').get_catalog(loc=self.catalog_dir)
+        with mock.patch.object(catalog, '_read_manifest_bytes',
+                               wraps=catalog._read_manifest_bytes) as read_manifest:
+            catalog.clean()
+            self.assertFalse(read_manifest.called)
+        self.assertTrue(catalog.get_manifest("meep", 1) is not None)
+        for sha in manifest.shas():
+            self.assertTrue(catalog._get_file_info(sha) is not None)
+        self.assertTrue(catalog._get_file_info(unreferenced) is None)
+
+    def _build_catalog_with_garbage(self):
+        catalog = self._build_test_catalog()
+        manifest1 = catalog.get_manifest("meep", 1)
+        for f in os.listdir(self.scratch_dir):
+            os.remove(os.path.join(self.scratch_dir, f))
+        create_random_file(self.scratch_dir)
+        create_random_file(self.scratch_dir)
+        create_bundle_version(catalog, "meep", self.scratch_dir)
+        catalog.delete_bundle_version("meep", 1)
+        return catalog, manifest1.shas(), catalog.get_manifest("meep", 2).shas()
+
+    def test_incremental_clean(self):
+        catalog, garbage, live = self._build_catalog_with_garbage()
+        self.assertTrue(collect_garbage(catalog, grace_period=0))
+        for sha in garbage:
+            self.assertTrue(catalog._get_file_info(sha) is None)
+        for sha in live:
+            self.assertTrue(catalog._get_file_info(sha) is not None)
+        ph = catalog.path_helper
+        self.assertFalse(self.path_exists_in_catalog(ph.path_for_manifest_for_bundle_version("meep", 1)))
+        self.assertTrue(self.path_exists_in_catalog(ph.path_for_manifest_for_bundle_version("meep", 2)))
+        self.assertFalse(self.path_exists_in_catalog(ph.path_for_archive_for_bundle_version("meep", 1)))
+        self.assertTrue(self.path_exists_in_catalog(ph.path_for_archive_for_bundle_version("meep", 2)))
+        self.assertFalse(self.path_exists_in_catalog(ph.path_for_gc_state()))
+
+    def test_incremental_clean_keeps_files_in_grace_period(self):
+        catalog, garbage, live = self._build_catalog_with_garbage()
+        self.assertTrue(collect_garbage(catalog))
+        for sha in garbage:
+            self.assertTrue(catalog._get_file_info(sha) is not None)
+
+    def test_incremental_clean_deletes_under_lock(self):
+        catalog, garbage, live = self._build_catalog_with_garbage()
+        storage = catalog._storage
+        delete_many = storage.delete_many
+
+        def locked_delete_many(subpaths):
+            # no bundle version can start referencing a deleted object
+            self.assertTrue(catalog.lock().is_locked())
+            delete_many(subpaths)
+
+        with mock.patch.object(storage, 'delete_many', side_effect=locked_delete_many) as m:
+            self.assertTrue(collect_garbage(catalog, grace_period=0))
+        self.assertTrue(m.called)
+        for sha in garbage:
+            self.assertTrue(catalog._get_file_info(sha) is None)
+
+    def test_incremental_clean_resumes(self):
+        catalog, garbage, live = self._build_catalog_with_garbage()
+        runs = 0
+        while not collect_garbage(catalog, time_budget=1e-9, grace_period=0):
+            self.assertTrue(self.path_exists_in_catalog(catalog.path_helper.path_for_gc_state()))
+            runs += 1
+        self.assertTrue(runs > 1)
+        for sha in garbage:
+            self.assertTrue(catalog._get_file_info(sha) is None)
+        for sha in live:
+            self.assertTrue(catalog._get_file_info(sha) is not None)
+
     def test_update_flavorspec(self):
         #set up
         catalog = self._build_test_catalog()
@@ -1,7 +1,10 @@
 import unittest
 import os.path
+import json
 
-from zinc.models import ZincIndex, ZincFlavorSpec, ZincFileList, ZincManifest
+import jsonschema
+
+from zinc.models import ZincIndex, ZincFlavorSpec, ZincFileList, ZincManifest, index_shard_for_bundle, diff_file_lists
 from zinc.helpers import bundle_id_from_bundle_descriptor, bundle_version_from_bundle_descriptor
 
 from tests import TempDirTestCase, abs_path_for_fixture
@@ -169,6 +172,69 @@ class ZincIndexTestCase(TempDirTestCase):
         self.assertFalse(immutable_index.is_mutable)
 
 
+    def test_clone_is_isolated(self):
+        index = ZincIndex(id='com.foo')
+        index.add_version_for_bundle("meep", 1)
+        clone = index.clone()
+        clone.add_version_for_bundle("meep", 2)
+        self.assertEqual(index.versions_for_bundle("meep"), [1])
+
+    def test_generation(self):
+        index = ZincIndex(id='com.foo')
+        generation = index.generation
+        index.add_version_for_bundle("meep", 1)
+        self.assertTrue(index.generation > generation)
+
+    def test_sharded_index_loads_shards_on_demand(self):
+        index = ZincIndex(id='com.foo')
+        index.add_version_for_bundle("meep", 1)
+        index.add_version_for_bundle("bork", 2)
+        index.shard(2)
+        root = index.to_shard_root_dict()
+        shards = {k: json.loads(v.decode('utf8'))['bundles']
+                  for k, v in index.changed_shards().items()}
+        loaded = list()
+
+        def load_shard(shard, digest):
+            self.assertEqual(digest, root['shards'][shard])
+            loaded.append(shard)
+            return shards[shard]
+
+        sharded = ZincIndex.from_shard_root(root, load_shard)
+        self.assertEqual(sharded.versions_for_bundle("meep"), [1])
+        self.assertEqual(loaded, [index_shard_for_bundle("meep", 2)])
+        self.assertEqual(sorted(sharded.bundle_names()), ["bork", "meep"])
+        self.assertEqual(sharded.changed_shards(), dict())
+
+    def test_sharded_index_changed_shards(self):
+        index = ZincIndex(id='com.foo')
+        index.add_version_for_bundle("meep", 1)
+        index.add_version_for_bundle("bork", 2)
+        index.shard(2)
+        index.mark_shards_saved(index.to_shard_root_dict())
+        self.assertEqual(index.changed_shards(), dict())
+        index.add_version_for_bundle("meep", 2)
+        self.assertEqual(list(index.changed_shards().keys()),
+                         [index_shard_for_bundle("meep", 2)])
+
+    def test_journal_ops_replay(self):
+        index = ZincIndex(id='com.foo')
+        index.add_version_for_bundle("meep", 1)
+        index.increment_next_version_for_bundle("meep")
+        index.update_distribution("master", "meep", 1)
+        ops = index.pop_journal_ops()
+        self.assertEqual(len(ops), 3)
+        self.assertEqual(index.pop_journal_ops(), [])
+        replayed = ZincIndex(id='com.foo')
+        replayed.apply_journal_ops(ops)
+        self.assertEqual(replayed.to_dict(), index.to_dict())
+        self.assertEqual(replayed.pop_journal_ops(), [])
+
+    def test_journal_ops_invalid(self):
+        index = ZincIndex(id='com.foo')
+        self.assertRaises(ValueError, index.apply_journal_ops, [['_get_or_create_bundle_info', ['meep']]])
+
+
 class ZincFileListTestCase(unittest.TestCase):
 
     def test_immutable(self):
@@ -190,6 +256,39 @@ class ZincFileListTestCase(unittest.TestCase):
         filelist = ZincFileList()
         self.assertTrue(filelist.sha_for_file('doesnotexist.toml') is None)
 
+    def test_round_trip(self):
+        d = {
+            'a': {
+                'sha': 'ea502a7bbd407872e50b9328956277d0228272d4',
+                'formats': {'raw': {'size': 123}, 'gz': {'size': 45}},
+                'flavors': ['small'],
+            },
+            'b': {'sha': '123'},
+            'c': {
+                'sha': 'ea502a7bbd407872e50b9328956277d0228272d4',
+                'formats': {'raw': {'size': 1, 'other': True}},
+            },
+        }
+        filelist = ZincFileList.from_dict(json.loads(json.dumps(d)))
+        self.assertEqual(filelist.to_dict(), d)
+        self.assertEqual(filelist['a'], d['a'])
+        self.assertEqual(filelist.get_format_info_for_file('a', preferred_formats=['raw']),
+                         ('raw', {'size': 123}))
+        self.assertEqual(list(filelist.get_all_files(flavor='small')), ['a'])
+
+        filelist.add_format_for_file('a', 'raw', 124)
+        filelist.add_flavor_for_file('a', 'large')
+        self.assertEqual(filelist.formats_for_file('a')['raw'], {'size': 124})
+        self.assertEqual(filelist.flavors_for_file('a'), ['small', 'large'])
+        filelist.add_flavor_for_file('b', 'small')
+        self.assertEqual(sorted(filelist.get_all_files(flavor='small')), ['a', 'b'])
+        del filelist['a']
+        self.assertEqual(filelist.get_all_files(flavor='small'), ['b'])
+        self.assertEqual(filelist.get_all_files(flavor='medium'), [])
+        # entries returned are copies
+        filelist['b']['sha'] = 'x'
+        self.assertEqual(filelist.sha_for_file('b'), '123')
+
 
 class ZincManifestTestCase(TempDirTestCase):
 
@@ -253,6 +352,64 @@ class ZincManifestTestCase(TempDirTestCase):
         immutable_manifest = ZincManifest.from_dict(d, mutable=False)
         self.assertFalse(immutable_manifest.is_mutable)
 
+    def test_digest(self):
+        manifest1 = ZincManifest('com.foo', 'stuff', 1)
+        manifest1.add_file('a', 'ea502a7bbd407872e50b9328956277d0228272d4')
+        manifest1.add_format_for_file('a', 'raw', 123)
+        manifest1.add_flavor_for_file('a', 'small')
+        manifest1.add_flavor_for_file('a', 'large')
+        manifest2 = ZincManifest('com.foo', 'stuff', 2)
+        manifest2.add_file('a', 'ea502a7bbd407872e50b9328956277d0228272d4')
+        manifest2.add_flavor_for_file('a', 'large')
+        manifest2.add_flavor_for_file('a', 'small')
+        self.assertEqual(manifest1.digest, manifest2.digest)
+        self.assertTrue(manifest1.files.contents_are_equalivalent(manifest2.files))
+
+        manifest2.add_file('b', 'ea502a7bbd407872e50b9328956277d0228272d4')
+        manifest2.add_format_for_file('a', 'raw', 123)
+        manifest2.add_format_for_file('b', 'raw', 123)
+        self.assertNotEqual(manifest1.digest, manifest2.digest)
+
+        # the digest is always computed, never read from the manifest
+        self.assertNotIn('digest', manifest2.to_dict())
+        loaded = ZincManifest.from_bytes(manifest2.to_bytes())
+        self.assertEqual(loaded.digest, manifest2.digest)
+        d = manifest2.to_dict()
+        d['digest'] = manifest1.digest
+        self.assertRaises(jsonschema.ValidationError, ZincManifest.from_bytes, json.dumps(d))
+
+    def test_validation(self):
+        d = ZincManifest('com.foo', 'stuff', 1).to_dict()
+        d['extra'] = True
+        b = json.dumps(d)
+        self.assertRaises(jsonschema.ValidationError, ZincManifest.from_bytes, b)
+        manifest = ZincManifest.from_bytes(b, trusted=True)
+        self.assertEqual(manifest.bundle_name, 'stuff')
+        self.assertIs(ZincManifest.validator(), ZincManifest.validator())
+
+
+class DiffFileListsTestCase(unittest.TestCase):
+
+    def _filelist(self, files):
+        filelist = ZincFileList()
+        for path, (sha, size) in files.items():
+            filelist.add_file(path, sha)
+            filelist.add_format_for_file(path, 'raw', size)
+        return filelist
+
+    def test_diff(self):
+        from_files = self._filelist({'a': ('1' * 40, 10), 'b': ('2' * 40, 20), 'c': ('3' * 40, 30)})
+        to_files = self._filelist({'b': ('4' * 40, 25), 'c': ('3' * 40, 30), 'd': ('5' * 40, 5)})
+        to_files.add_flavor_for_file('d', 'small')
+        diffs = list(diff_file_lists(from_files, to_files))
+        self.assertEqual([(d.path, d.change, d.size_delta) for d in diffs],
+                         [('a', 'removed', -10), ('b', 'modified', 5), ('d', 'added', 5)])
+        self.assertEqual(diffs[1].from_sha, '2' * 40)
+        self.assertEqual(diffs[1].to_sha, '4' * 40)
+
+        diffs = list(diff_file_lists(from_files, to_files, flavor='small'))
+        self.assertEqual([(d.path, d.change) for d in diffs], [('d', 'added')])
+
 
 class ZincFlavorSpecTestCase(unittest.TestCase):
 
@@ -262,6 +419,13 @@ class ZincFlavorSpecTestCase(unittest.TestCase):
         self.assertTrue(spec is not None)
         self.assertEqual(len(spec.flavors), 2)
 
+    def test_flavors_for_path(self):
+        d = {'small': ['+ */50x50/*', '- *'], 'large': ['+ */100x100/*', '- *'],
+             'all': ['+ *']}
+        spec = ZincFlavorSpec.from_dict(d)
+        self.assertEqual(sorted(spec.flavors_for_path('/a/50x50/b.png')), ['all', 'small'])
+        self.assertEqual(spec.flavors_for_path('/a/b.png'), ['all'])
+
     def test_immutable(self):
         spec = ZincFlavorSpec(mutable=False)
         self.assertFalse(spec.is_mutable)
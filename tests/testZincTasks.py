@@ -1,4 +1,67 @@
 from tests import *
+from unittest import mock
 
 class TestZincBundleCloneTask(unittest.TestCase):
     pass
+
+
+class TestScratchObjects(TempDirTestCase):
+
+    def test_release_and_evict(self):
+        from zinc.tasks.bundle_update import _ScratchObjects
+        import zinc.utils as utils
+
+        src_dir = os.path.join(self.dir, 'src')
+        scratch_dir = os.path.join(self.dir, 'scratch')
+        os.makedirs(src_dir)
+        os.makedirs(scratch_dir)
+        path1 = create_random_file(src_dir)
+        path2 = create_random_file(src_dir)
+        sha1 = utils.sha1_for_path(path1)
+        sha2 = utils.sha1_for_path(path2)
+
+        objects = _ScratchObjects(scratch_dir, {sha1: 2, sha2: 1}, max_bytes=0)
+        gz_path1 = objects.acquire(sha1, path1)
+        gz_path2 = objects.acquire(sha2, path2)
+        # pinned objects are not evicted
+        objects.release(sha2)
+        self.assertTrue(os.path.exists(gz_path1))
+        self.assertFalse(os.path.exists(gz_path2))
+        objects.release(sha1)
+        # evicted, since it is over budget, but compressed again when needed
+        self.assertFalse(os.path.exists(gz_path1))
+        self.assertEqual(objects.acquire(sha1, path1), gz_path1)
+        objects.release(sha1)
+        self.assertEqual(os.listdir(scratch_dir), [])
+        self.assertEqual(objects.size, 0)
+
+        self.assertRaises(Exception, objects.acquire, sha2, path1)
+
+    def test_add_and_set_uses(self):
+        from zinc.tasks.bundle_update import _ScratchObjects
+        import zinc.utils as utils
+
+        src_dir = os.path.join(self.dir, 'src')
+        scratch_dir = os.path.join(self.dir, 'scratch')
+        os.makedirs(src_dir)
+        os.makedirs(scratch_dir)
+        path1 = create_random_file(src_dir)
+        path2 = create_random_file(src_dir)
+
+        objects = _ScratchObjects(scratch_dir, None, max_bytes=1 << 20)
+        shas = list()
+        for path in (path1, path2):
+            with open(objects.path_for_sha('tmp'), 'wb') as f:
+                sha = utils.sha1_and_gzip_path(path, f)
+            os.rename(objects.path_for_sha('tmp'), objects.path_for_sha(sha))
+            objects.add(sha, objects.path_for_sha(sha))
+            shas.append(sha)
+        # copies without uses are dropped
+        objects.set_uses({shas[0]: 1})
+        self.assertFalse(os.path.exists(objects.path_for_sha(shas[1])))
+        # handed over copies are not compressed again
+        with mock.patch('zinc.utils.sha1_and_gzip_path') as sha1_and_gzip_path:
+            self.assertEqual(objects.acquire(shas[0], path1), objects.path_for_sha(shas[0]))
+            self.assertFalse(sha1_and_gzip_path.called)
+        objects.release(shas[0])
+        self.assertEqual(os.listdir(scratch_dir), [])
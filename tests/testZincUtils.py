@@ -0,0 +1,42 @@
+import unittest
+
+from zinc.utils import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_missing(self):
+        cache = LRUCache(2)
+        self.assertTrue(cache.get('a') is None)
+        self.assertEqual(cache.misses, 1)
+
+    def test_put_and_get(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+
+    def test_evicts_by_size(self):
+        cache = LRUCache(10, max_size=100)
+        cache.put('a', 1, size=60)
+        cache.put('b', 2, size=60)
+        self.assertFalse('a' in cache)
+        self.assertTrue('b' in cache)
+        self.assertEqual(cache.size, 60)
+
+    def test_pop(self):
+        cache = LRUCache(2)
+        cache.put('a', 1, size=10)
+        cache.pop('a')
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.size, 0)